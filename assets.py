@@ -0,0 +1,223 @@
+from PIL import Image
+import hashlib
+import io
+import numpy as np
+from framepack import PATCH, PATCH_COUNT
+
+# Offline analysis of the frame images, used while building frame packs. The
+# player itself never imports this module.
+
+
+def open_frame(data):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+def encode_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+# Full canvas RGBA array of a frame drawn at its offset
+def canvas_array(image, bbox, canvas_size):
+    canvas = np.zeros((canvas_size[1], canvas_size[0], 4), dtype=np.uint8)
+    x, y, w, h = bbox
+    canvas[y:y + h, x:x + w] = np.asarray(image.convert("RGBA"))
+    return canvas
+
+
+# Rectangles (x, y, w, h) covering every pixel that differs between two
+# canvases
+def changed_rects(previous, current, tile=16):
+    changed = previous != current
+    if changed.ndim == 3:
+        changed = changed.any(axis=2)
+    return mask_rects(changed, tile)
+
+
+# Rectangles (x, y, w, h) covering every set pixel of a boolean mask. Pixels
+# are collected on a tile grid, runs of set tiles in a row become rectangles
+# and rectangles spanning the same columns in consecutive rows are merged.
+def mask_rects(changed, tile=16):
+    height, width = changed.shape
+    rows = -(-height // tile)
+    columns = -(-width // tile)
+    padded = np.zeros((rows * tile, columns * tile), dtype=bool)
+    padded[:height, :width] = changed
+    tiles = padded.reshape(rows, tile, columns, tile).any(axis=(1, 3))
+
+    rects = []
+    open_runs = {}
+    for row in range(rows):
+        runs = {}
+        column = 0
+        while column < columns:
+            if not tiles[row, column]:
+                column += 1
+                continue
+            start = column
+            while column < columns and tiles[row, column]:
+                column += 1
+            runs[(start, column)] = open_runs.pop((start, column), row)
+        rects.extend((start, first, end, row) for (start, end), first in open_runs.items())
+        open_runs = runs
+    rects.extend((start, first, end, rows) for (start, end), first in open_runs.items())
+
+    result = []
+    for start, first, end, last in rects:
+        x, y = start * tile, first * tile
+        result.append((x, y, min(end * tile, width) - x, min(last * tile, height) - y))
+    return result
+
+
+# Delta frame payload holding the PNG of every changed rectangle, current is
+# an RGBA canvas or an array of palette indices
+def encode_delta(current, rects):
+    patches = []
+    for x, y, w, h in rects:
+        patches.append(encode_png(Image.fromarray(np.ascontiguousarray(current[y:y + h, x:x + w]))))
+    header = PATCH_COUNT.pack(len(rects))
+    header += b"".join(PATCH.pack(*rect, len(data)) for rect, data in zip(rects, patches))
+    return header + b"".join(patches)
+
+
+def union_rect(rects):
+    if not rects:
+        return 0, 0, 0, 0
+    left = min(x for x, _, _, _ in rects)
+    top = min(y for _, y, _, _ in rects)
+    right = max(x + w for x, _, w, _ in rects)
+    bottom = max(y + h for _, y, _, h in rects)
+    return left, top, right - left, bottom - top
+
+
+# Small float thumbnail of a canvas for perceptual comparisons, colour is
+# weighted by alpha so invisible pixels do not count
+def thumbnail(canvas, size=(32, 18)):
+    small = np.asarray(Image.fromarray(canvas).resize(size, Image.BILINEAR), dtype=np.float32) / 255
+    return np.concatenate([small[..., :3] * small[..., 3:], small[..., 3:]], axis=2)
+
+
+def perceptual_difference(first, second):
+    return float(np.abs(first - second).mean())
+
+
+# Collapse duplicate frames. A run of consecutive frames that are identical or
+# within threshold of the run's first frame becomes that one frame shown for
+# the sum of the run's delays. Returns the kept (source index, delay) pairs.
+def dedup_frames(canvases, delays, threshold=0.0):
+    kept = []
+    run_start = None
+    run_hash = None
+    run_thumbnail = None
+    for index, canvas in enumerate(canvases):
+        digest = hashlib.sha1(canvas.tobytes()).digest()
+        if run_start is not None:
+            same = digest == run_hash
+            if not same and threshold > 0:
+                same = perceptual_difference(run_thumbnail, thumbnail(canvas)) <= threshold
+            if same:
+                kept[-1] = (run_start, kept[-1][1] + delays[index])
+                continue
+        run_start, run_hash = index, digest
+        run_thumbnail = thumbnail(canvas) if threshold > 0 else None
+        kept.append((index, delays[index]))
+    return kept
+
+
+# Every step-th item, spread over the sequence, of about sample_frames items
+def palette_samples(items, sample_frames=64):
+    return items[::max(1, len(items) // sample_frames)]
+
+
+# Shared palette for a sequence: k-means over pixels sampled from up to
+# sample_frames frames in premultiplied RGBA. Index 0 is reserved for fully
+# transparent pixels. Returns a (colors, 4) uint8 array of straight RGBA.
+def build_palette(canvases, colors=256, sample_frames=64, sample_pixels=200000, iterations=10, seed=0):
+    rng = np.random.default_rng(seed)
+    pixels = np.concatenate([canvas.reshape(-1, 4) for canvas in palette_samples(canvases, sample_frames)])
+    pixels = pixels[pixels[:, 3] > 0]
+    if len(pixels) > sample_pixels:
+        pixels = pixels[rng.choice(len(pixels), sample_pixels, replace=False)]
+    samples = premultiply(pixels.astype(np.float32))
+
+    count = min(colors - 1, len(samples))
+    centers = samples[rng.choice(len(samples), count, replace=False)]
+    for _ in range(iterations):
+        labels = nearest(samples, centers)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, samples)
+        sizes = np.bincount(labels, minlength=count)[:, None]
+        centers = np.where(sizes > 0, sums / np.maximum(sizes, 1), centers)
+
+    palette = np.zeros((colors, 4), dtype=np.uint8)
+    palette[1:count + 1] = np.clip(np.round(unpremultiply(centers)), 0, 255)
+    return palette
+
+
+def premultiply(rgba):
+    return np.concatenate([rgba[:, :3] * rgba[:, 3:] / 255, rgba[:, 3:]], axis=1)
+
+
+def unpremultiply(rgba):
+    alpha = np.maximum(rgba[:, 3:], 1e-6)
+    return np.concatenate([np.minimum(rgba[:, :3] * 255 / alpha, 255), rgba[:, 3:]], axis=1)
+
+
+# Index of the closest center for every sample, in chunks to bound memory
+def nearest(samples, centers, chunk=65536):
+    labels = np.empty(len(samples), dtype=np.intp)
+    center_norms = (centers ** 2).sum(axis=1)
+    for start in range(0, len(samples), chunk):
+        block = samples[start:start + chunk]
+        distances = center_norms[None, :] - 2 * block @ centers.T
+        labels[start:start + chunk] = distances.argmin(axis=1)
+    return labels
+
+
+# Map a canvas to palette indices, fully transparent pixels become index 0
+def quantize_canvas(canvas, palette):
+    pixels = canvas.reshape(-1, 4)
+    indices = np.zeros(len(pixels), dtype=np.uint8)
+    visible = pixels[:, 3] > 0
+    centers = premultiply(palette[1:].astype(np.float32))
+    indices[visible] = nearest(premultiply(pixels[visible].astype(np.float32)), centers) + 1
+    return indices.reshape(canvas.shape[:2])
+
+
+def expand(indices, palette):
+    return palette[indices]
+
+
+# Bounding box (x, y, w, h) of the non transparent indices, at least one pixel
+def index_bbox(indices):
+    rows = np.flatnonzero(indices.any(axis=1))
+    columns = np.flatnonzero(indices.any(axis=0))
+    if not len(rows):
+        return 0, 0, 1, 1
+    return int(columns[0]), int(rows[0]), int(columns[-1] - columns[0] + 1), int(rows[-1] - rows[0] + 1)
+
+
+# Peak signal to noise ratio in dB between two canvases, compared premultiplied
+# so colour hidden under zero alpha does not count
+def psnr(original, approximation):
+    first = premultiply(original.reshape(-1, 4).astype(np.float32))
+    second = premultiply(approximation.reshape(-1, 4).astype(np.float32))
+    error = float(((first - second) ** 2).mean())
+    if error == 0:
+        return float("inf")
+    return 10 * np.log10(255 ** 2 / error)
+
+
+# Palette indices stored as an 8-bit greyscale PNG, the shared palette lives in
+# the pack so every frame can be expanded with the same colour table
+def encode_indices(indices):
+    return encode_png(Image.fromarray(indices))
+
+
+# Palette as 0xAARRGGBB values, the layout of a Qt colour table
+def palette_argb(palette):
+    palette = palette.astype(np.uint32)
+    return [int(value) for value in (palette[:, 3] << 24) | (palette[:, 0] << 16) | (palette[:, 1] << 8) | palette[:, 2]]
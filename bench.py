@@ -0,0 +1,372 @@
+import os
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtWidgets import QApplication
+from PySide6.QtGui import QImage, QPainter
+from PySide6.QtCore import Qt, QEventLoop, QPoint, QTimer
+import argparse
+import gc
+import json
+import math
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from disk_cache import FrameDiskCache, source_key
+from frame_view import FrameView
+from framepack import FramePack, LooseFrames
+from frames import FrameCache, decode_frame, decode_source, expand_frame, frame_cost, has_delta_frames
+from memory import rss_bytes
+from playback import Player
+from settings import DEFAULT_SETTINGS, read_settings, write_settings
+
+# Headless benchmarks of the playback path, run with: python bench.py [names]
+# Results are printed as JSON, and written to a file with --output. With
+# --baseline the results are compared to an earlier --output file instead and
+# the exit status is 1 when a metric regressed. Both run every benchmark
+# several times and keep the medians.
+
+base_path = os.path.abspath(os.path.dirname(__file__))
+
+
+def load_frames():
+    pack_path = os.path.join(base_path, "frames.pack")
+    if os.path.exists(pack_path):
+        return FramePack(pack_path)
+    return LooseFrames(os.path.join(base_path, "img"))
+
+
+# Run fn repeatedly for at least min_time seconds, returns per call timings in ms
+def measure(fn, min_time=0.5, min_runs=20):
+    timings = []
+    start = time.perf_counter()
+    while len(timings) < min_runs or time.perf_counter() - start < min_time:
+        began = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - began) * 1000)
+    return timings
+
+
+def summary(timings):
+    timings = sorted(timings)
+    return {
+        "median_ms": round(statistics.median(timings), 4),
+        "p95_ms": round(timings[max(0, math.ceil(len(timings) * 0.95) - 1)], 4),
+        "runs": len(timings),
+    }
+
+
+def sample_indexes(frames, samples=16):
+    return range(0, len(frames), max(1, len(frames) // samples))
+
+
+# The playback loop of main14.py driving a FrameView, every tick is timed
+class TimedPlayer(Player):
+    def __init__(self, view, cache_mb=64):
+        super().__init__(view, FrameCache(cache_mb * 1024 * 1024))
+        self.ticks = []
+
+    def tick(self):
+        began = time.perf_counter()
+        super().tick()
+        self.ticks.append((time.perf_counter() - began) * 1000)
+
+
+# Decode latency of single frames, from compressed data to a frame ready to
+# paint
+def bench_decode(frames):
+    indexes = list(sample_indexes(frames))
+    position = [0]
+
+    def decode():
+        index = indexes[position[0] % len(indexes)]
+        position[0] += 1
+        decode_source(frames, index)
+    return summary(measure(decode))
+
+
+# Real time playback for duration seconds: cost of every timer tick, frames
+# shown per second against the rate the delays ask for and dropped frames
+def bench_playback(frames, duration=3.0):
+    if has_delta_frames(frames):
+        # The back buffer needs a fresh source position
+        frames = load_frames()
+    view = FrameView()
+    view.show()
+    player = TimedPlayer(view)
+    loop = QEventLoop()
+    QTimer.singleShot(int(duration * 1000), loop.quit)
+    player.load(frames)
+    began = time.monotonic()
+    loop.exec()
+    elapsed = time.monotonic() - began
+    player.stop()
+    view.close()
+    stats = player.scheduler.stats()
+    mean_delay = player.scheduler.duration / len(frames)
+    return {
+        "tick": summary(player.ticks),
+        "fps": round(stats["shown"] / elapsed, 2),
+        "target_fps": round(1 / mean_delay, 2),
+        "shown": stats["shown"],
+        "dropped": stats["dropped"],
+    }
+
+
+# Resident memory added per decoded frame held in memory, against the size
+# FrameCache charges for it
+def bench_memory(frames, count=64):
+    indexes = [index % len(frames) for index in range(count)]
+    gc.collect()
+    before = rss_bytes()
+    held = [decode_source(frames, index) for index in indexes]
+    after = rss_bytes()
+    result = {
+        "frames": len(held),
+        "cost_bytes_per_frame": round(sum(frame_cost(frame) for frame in held) / len(held)),
+        "rss_bytes_per_frame": round((after - before) / len(held)) if before is not None else None,
+    }
+    del held
+    return result
+
+
+# Reading and writing the settings file
+def bench_settings(frames):
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "settings.json")
+        write_settings(DEFAULT_SETTINGS, path)
+        return {
+            "load": summary(measure(lambda: read_settings(path))),
+            "save": summary(measure(lambda: write_settings(DEFAULT_SETTINGS, path))),
+        }
+    finally:
+        shutil.rmtree(directory)
+
+
+# Time from opening the frames to the first frame painted, decoding it from the
+# compressed frames and mapping it from a warm on-disk frame cache
+def bench_first_frame(frames, runs=5):
+    view = FrameView()
+    view.show()
+
+    def first_frame(open_frames):
+        timings = []
+        for _ in range(runs):
+            began = time.perf_counter()
+            source = open_frames()
+            image = decode_source(source, 0)
+            view.set_frame(image, QPoint(*source.bbox(0)[:2]))
+            view.repaint()
+            timings.append((time.perf_counter() - began) * 1000)
+        return summary(timings)
+
+    result = {"decoded": first_frame(load_frames)}
+    # Only frames the player would cache on disk are timed from the cache
+    if not has_delta_frames(frames) and FrameDiskCache().fits(frames):
+        directory = tempfile.mkdtemp()
+        try:
+            disk_cache = FrameDiskCache(directory)
+            disk_cache.store(source_key(frames), frames, lambda index: decode_source(frames, index))
+
+            def open_cached():
+                source = load_frames()
+                return disk_cache.open(source_key(source), source)
+            result["disk_cache"] = first_frame(open_cached)
+        finally:
+            shutil.rmtree(directory)
+    view.close()
+    return result
+
+
+# Cost of painting one frame onto a premultiplied target the way FrameView
+# does, for frames left in the format the PNG decoder produces and for frames
+# converted to ARGB32 premultiplied once at decode time
+def bench_paint(frames, samples=16):
+    target = QImage(*frames.canvas_size, QImage.Format_ARGB32_Premultiplied)
+    target.fill(Qt.transparent)
+    indexes = sample_indexes(frames, samples)
+    native = []
+    converted = []
+    for index in indexes:
+        image = QImage.fromData(frames[index], "PNG")
+        if frames.palette is not None and image.reinterpretAsFormat(QImage.Format_Indexed8):
+            image.setColorTable(frames.palette)
+        native.append((frames.bbox(index)[:2], image))
+        converted.append((frames.bbox(index)[:2], expand_frame(decode_frame(frames[index], frames.palette))))
+
+    def painter_for(images):
+        position = [0]
+
+        def paint():
+            (x, y), image = images[position[0] % len(images)]
+            position[0] += 1
+            painter = QPainter(target)
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            painter.drawImage(x, y, image)
+            painter.end()
+        return paint
+
+    return {
+        "native_formats": sorted({image.format().name for _, image in native}),
+        "native": summary(measure(painter_for(native))),
+        "premultiplied": summary(measure(painter_for(converted))),
+    }
+
+
+BENCHMARKS = {
+    "decode": bench_decode,
+    "playback": bench_playback,
+    "memory": bench_memory,
+    "settings": bench_settings,
+    "first_frame": bench_first_frame,
+    "paint": bench_paint,
+}
+
+
+def run(names):
+    frames = load_frames()
+    return {name: BENCHMARKS[name](frames) for name in names}
+
+
+# Compared metrics by result key, with True where higher is better
+METRICS = {
+    "median_ms": False,
+    "fps": True,
+    "cost_bytes_per_frame": False,
+    "rss_bytes_per_frame": False,
+}
+
+
+# Compared metrics of a result tree as {"benchmark.path.key": value}
+def flatten(results, prefix=""):
+    values = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{key}."))
+        elif key in METRICS and isinstance(value, (int, float)):
+            values[prefix + key] = value
+    return values
+
+
+# Runs of every benchmark when results are recorded or compared, enough for the
+# spread to tell noise from a regression
+COMPARE_REPEAT = 5
+
+
+# Run the benchmarks repeat times. Returns the results of the first run with
+# every compared metric replaced by its median over all runs, and the spread
+# of every metric as its median absolute deviation.
+def run_repeated(names, repeat):
+    runs = [run(names) for _ in range(repeat)]
+    samples = {}
+    for results in runs:
+        for path, value in flatten(results).items():
+            samples.setdefault(path, []).append(value)
+    medians = {path: statistics.median(values) for path, values in samples.items()}
+    spreads = {path: statistics.median(abs(value - medians[path]) for value in values)
+               for path, values in samples.items()}
+
+    def substitute(results, prefix=""):
+        return {key: substitute(value, f"{prefix}{key}.") if isinstance(value, dict)
+                else medians.get(prefix + key, value)
+                for key, value in results.items()}
+    return substitute(runs[0]), spreads
+
+
+# Rows of (metric, baseline, current, relative change, status). A metric only
+# counts as regressed or improved when it moved by more than tolerance and by
+# more than three times its larger spread over the repeated runs.
+def compare(baseline, current, spreads, tolerance):
+    baseline = flatten(baseline)
+    current = flatten(current)
+    rows = []
+    for path in sorted(set(baseline) | set(current)):
+        if path not in current or path not in baseline:
+            rows.append((path, baseline.get(path), current.get(path), None,
+                         "missing" if path not in current else "new"))
+            continue
+        before, after = baseline[path], current[path]
+        change = (after - before) / before if before else 0.0
+        worse = -change if METRICS[path.rsplit(".", 1)[-1]] else change
+        significant = abs(after - before) > 3 * spreads.get(path, 0) and abs(change) > tolerance
+        status = ("regressed" if worse > 0 else "improved") if significant else "ok"
+        rows.append((path, before, after, change, status))
+    return rows
+
+
+def format_table(rows):
+    lines = [("metric", "baseline", "current", "change", "status")]
+    for path, before, after, change, status in rows:
+        lines.append((path, _format_value(before), _format_value(after),
+                      "" if change is None else f"{change:+.1%}", status))
+    widths = [max(len(line[column]) for line in lines) for column in range(5)]
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip() for line in lines)
+
+
+def _format_value(value):
+    if value is None:
+        return "-"
+    return f"{value:.4g}"
+
+
+def environment():
+    frames = load_frames()
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "qt_platform": os.environ.get("QT_QPA_PLATFORM"),
+        "source": type(frames).__name__,
+        "frames": len(frames),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the playback hot path")
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run, any of {', '.join(BENCHMARKS)}")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--repeat", type=int, default=None,
+                        help=f"run the benchmarks this often and keep the medians, defaults to {COMPARE_REPEAT} "
+                             "with --output or --baseline and to 1 otherwise")
+    parser.add_argument("--baseline", help="compare against the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="relative change of a metric allowed before it counts as a regression")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if not any(baseline.get("spreads", {}).values()):
+            parser.error(f"{args.baseline} has no spread between runs, record it again with --repeat {COMPARE_REPEAT}")
+    names = args.names or (list(baseline["benchmarks"]) if baseline else list(BENCHMARKS))
+
+    repeat = args.repeat
+    if repeat is None:
+        repeat = COMPARE_REPEAT if args.output or args.baseline else 1
+
+    app = QApplication(sys.argv[:1])
+    benchmarks, spreads = run_repeated(names, max(1, repeat))
+    results = {"environment": environment(), "repeat": max(1, repeat), "benchmarks": benchmarks,
+               "spreads": spreads}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+    if baseline is None:
+        print(json.dumps(results, indent=4))
+        sys.exit(0)
+
+    baseline_benchmarks = {name: baseline["benchmarks"][name] for name in names if name in baseline["benchmarks"]}
+    baseline_spreads = baseline.get("spreads", {})
+    spreads = {path: max(spread, baseline_spreads.get(path, 0)) for path, spread in spreads.items()}
+    rows = compare(baseline_benchmarks, benchmarks, spreads, args.tolerance)
+    print(format_table(rows))
+    regressed = [row[0] for row in rows if row[4] == "regressed"]
+    if regressed:
+        print(f"{len(regressed)} metrics regressed by more than {args.tolerance:.0%}: {', '.join(regressed)}")
+        sys.exit(1)
+    print(f"No regressions beyond {args.tolerance:.0%}")
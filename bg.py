@@ -0,0 +1,420 @@
+from PIL import Image
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import io
+import json
+import os
+import numpy as np
+from assets import mask_rects
+from framepack import content_hash, list_frames
+
+# Background removal for the source frames: every PNG of the input folder is
+# matted by a backend and written under the same name, so the delay in the
+# name survives. A state file in the output folder remembers the input and
+# output hash of every frame, frames whose output is up to date are skipped
+# and an interrupted run picks up where it stopped.
+STATE_NAME = "bg_state.json"
+STATE_SAVE_EVERY = 20
+
+
+# A matting backend turns an RGBA frame array into an RGBA array with the
+# background made transparent. settings() goes into the state so changing the
+# backend or its settings redoes every frame, load() runs once in every worker
+# process before the first frame. matte_batch() gets frames of one size
+# stacked into a single (frames, height, width, 4) array. A local backend
+# decides every pixel from the pixels at most radius() away only, so matting a
+# crop gives the same pixels as matting the whole frame everywhere but in the
+# radius() pixels along the edges of the crop.
+class MattingBackend(ABC):
+    name = None
+    local = False
+
+    def settings(self):
+        return {}
+
+    def radius(self):
+        return 0
+
+    def load(self):
+        pass
+
+    @abstractmethod
+    def matte(self, rgba):
+        pass
+
+    def matte_batch(self, frames):
+        return np.stack([self.matte(rgba) for rgba in frames])
+
+
+# rembg with alpha matting, the original processing of the frames
+class RembgBackend(MattingBackend):
+    name = "rembg"
+
+    def __init__(self, erode_size=15):
+        self.erode_size = int(erode_size)
+        self._session = None
+
+    def settings(self):
+        return {"erode_size": self.erode_size}
+
+    def load(self):
+        import rembg
+        self._remove = rembg.remove
+        self._session = rembg.new_session()
+
+    def matte(self, rgba):
+        return np.asarray(self._remove(rgba, session=self._session, alpha_matting=True,
+                                       alpha_matting_erode_size=self.erode_size))
+
+
+# Keys out the colour of the frame border, every pixel closer than threshold
+# to the median border colour becomes transparent. Needs nothing but NumPy.
+class BorderKeyBackend(MattingBackend):
+    name = "border"
+
+    def __init__(self, threshold=40):
+        self.threshold = float(threshold)
+
+    def settings(self):
+        return {"threshold": self.threshold}
+
+    def matte(self, rgba):
+        rgb = rgba[..., :3].astype(np.int32)
+        border = np.concatenate([rgb[0], rgb[-1], rgb[:, 0], rgb[:, -1]])
+        key = np.median(border, axis=0)
+        distance = np.sqrt(((rgb - key) ** 2).sum(axis=2))
+        result = rgba.copy()
+        result[..., 3] = np.where(distance < self.threshold, 0, rgba[..., 3])
+        return result
+
+
+# Chroma key for footage shot against a flat screen. Pixels are compared to
+# key_color in CIELAB with lightness weighted down, so shading on the screen
+# matters less than its hue. Alpha is 0 within tolerance of the key, ramps up
+# over softness and is then eroded by erode pixels to drop the fringe and
+# softened over feather pixels, all on whole stacked batches at once.
+class ChromaKeyBackend(MattingBackend):
+    name = "chroma"
+    local = True
+
+    def __init__(self, key_color="#00b140", tolerance=12.0, softness=10.0, lightness_weight=0.25, erode=1,
+                 feather=1):
+        self.key_color = key_color
+        self.tolerance = float(tolerance)
+        self.softness = float(softness)
+        self.lightness_weight = float(lightness_weight)
+        self.erode = int(erode)
+        self.feather = int(feather)
+        key = np.array([int(key_color.lstrip("#")[i:i + 2], 16) for i in (0, 2, 4)], dtype=np.uint8)
+        self._key_lab = srgb_to_lab(key)
+
+    def settings(self):
+        return {"key_color": self.key_color, "tolerance": self.tolerance, "softness": self.softness,
+                "lightness_weight": self.lightness_weight, "erode": self.erode, "feather": self.feather}
+
+    # The erosion and then the blur each widen the neighbourhood
+    def radius(self):
+        return max(self.erode, 0) + max(self.feather, 0)
+
+    def matte(self, rgba):
+        return self.matte_batch(rgba[None])[0]
+
+    def matte_batch(self, frames):
+        difference = srgb_to_lab(frames[..., :3]) - self._key_lab
+        difference[..., 0] *= self.lightness_weight
+        distance = np.sqrt((difference ** 2).sum(axis=-1))
+        alpha = np.clip((distance - self.tolerance) / max(self.softness, 1e-6), 0, 1)
+        for axis in (1, 2):
+            alpha = min_filter(alpha, self.erode, axis)
+        for axis in (1, 2):
+            alpha = box_blur(alpha, self.feather, axis)
+        result = frames.copy()
+        result[..., 3] = np.minimum(frames[..., 3], np.round(alpha * 255).astype(np.uint8))
+        return result
+
+
+# sRGB D65 to XYZ
+RGB_TO_XYZ = np.array([[0.4124, 0.3576, 0.1805],
+                       [0.2126, 0.7152, 0.0722],
+                       [0.0193, 0.1192, 0.9505]], dtype=np.float32)
+WHITE_XYZ = np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+
+
+# CIELAB of an array of 8-bit sRGB colours along the last axis
+def srgb_to_lab(rgb):
+    linear = rgb.astype(np.float32) / 255
+    linear = np.where(linear <= 0.04045, linear / 12.92, ((linear + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ RGB_TO_XYZ.T / WHITE_XYZ
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16 / 116)
+    return np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+# Minimum over a window of 2 * radius + 1 along one axis, edges repeated
+def min_filter(values, radius, axis):
+    if radius <= 0:
+        return values
+    values = np.moveaxis(values, axis, -1)
+    padded = np.pad(values, [(0, 0)] * (values.ndim - 1) + [(radius, radius)], mode="edge")
+    result = padded[..., :values.shape[-1]].copy()
+    for shift in range(1, 2 * radius + 1):
+        np.minimum(result, padded[..., shift:shift + values.shape[-1]], out=result)
+    return np.moveaxis(result, -1, axis)
+
+
+# Mean over a window of 2 * radius + 1 along one axis, edges repeated
+def box_blur(values, radius, axis):
+    if radius <= 0:
+        return values
+    values = np.moveaxis(values, axis, -1)
+    padded = np.pad(values, [(0, 0)] * (values.ndim - 1) + [(radius + 1, radius)], mode="edge")
+    sums = np.cumsum(padded, axis=-1)
+    result = (sums[..., 2 * radius + 1:] - sums[..., :-2 * radius - 1]) / (2 * radius + 1)
+    return np.moveaxis(result, -1, axis)
+
+
+BACKENDS = {
+    RembgBackend.name: RembgBackend,
+    BorderKeyBackend.name: BorderKeyBackend,
+    ChromaKeyBackend.name: ChromaKeyBackend,
+}
+
+
+# Incremental matting of a frame sequence. Only the tiles whose source pixels
+# moved more than threshold away from the pixels their alpha was last matted
+# from are matted again, grown by padding pixels and with as much context
+# around them, the alpha of everything else is carried forward. The padding is
+# raised to the backend's radius() so every pixel a change can reach is
+# matted again and sees real neighbours. The first frame and every
+# keyframe_interval-th frame are matted whole. Only local backends give the
+# same result on a crop as on the whole frame.
+class IncrementalMatting:
+    def __init__(self, backend, threshold=8, padding=16, tile=16, keyframe_interval=30):
+        self.backend = backend
+        self.threshold = int(threshold)
+        self.padding = int(padding)
+        self.tile = int(tile)
+        self.keyframe_interval = int(keyframe_interval)
+        self.recomputed = 0
+        self.total = 0
+        self._reference = None
+        self._alpha = None
+        self._position = 0
+
+    def settings(self):
+        return {"threshold": self.threshold, "padding": self.padding, "tile": self.tile,
+                "keyframe_interval": self.keyframe_interval}
+
+    def matte(self, rgba):
+        height, width = rgba.shape[:2]
+        self.total += height * width
+        keyframe = self._position % self.keyframe_interval == 0
+        self._position += 1
+        if keyframe or self._reference is None or self._reference.shape != rgba.shape:
+            result = self.backend.matte(rgba)
+            self._reference = rgba.copy()
+            self._alpha = result[..., 3].copy()
+            self.recomputed += height * width
+            return result
+
+        moved = np.abs(rgba.astype(np.int16) - self._reference).max(axis=2) > self.threshold
+        padding = max(self.padding, self.backend.radius())
+        redone = np.zeros((height, width), dtype=bool)
+        result = rgba.copy()
+        result[..., 3] = self._alpha
+        for x, y, w, h in mask_rects(moved, self.tile):
+            left, top = max(x - padding, 0), max(y - padding, 0)
+            right, bottom = min(x + w + padding, width), min(y + h + padding, height)
+            # Matte with context around the region so edge filters see real neighbours
+            crop_left, crop_top = max(left - padding, 0), max(top - padding, 0)
+            crop_right, crop_bottom = min(right + padding, width), min(bottom + padding, height)
+            matted = self.backend.matte(rgba[crop_top:crop_bottom, crop_left:crop_right])
+            result[top:bottom, left:right] = matted[top - crop_top:bottom - crop_top, left - crop_left:right - crop_left]
+            redone[top:bottom, left:right] = True
+        self._reference[redone] = rgba[redone]
+        self._alpha = result[..., 3].copy()
+        self.recomputed += int(redone.sum())
+        return result
+
+
+def state_key(backend_name, backend_settings, source_hash):
+    return content_hash(json.dumps([backend_name, backend_settings, source_hash], sort_keys=True).encode())
+
+
+def read_state(output_folder):
+    try:
+        with open(os.path.join(output_folder, STATE_NAME)) as file:
+            return json.load(file)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def write_state(output_folder, state):
+    path = os.path.join(output_folder, STATE_NAME)
+    with open(path + ".tmp", "w") as file:
+        json.dump(state, file, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+
+
+# Each worker process builds its backend once, rembg loads its model here
+_backend = None
+
+
+def _init_worker(backend_name, options):
+    global _backend
+    _backend = BACKENDS[backend_name](**options)
+    _backend.load()
+
+
+# Matte a batch of (input path, output path) pairs, frames of the same size go
+# to the backend as one stacked array. With incremental settings the batch is
+# matted in order as one sequence instead. Returns the output hashes in order
+# and the number of pixels matted out of the total.
+def _matte_frames(paths, incremental=None):
+    frames = [np.asarray(Image.open(input_path).convert("RGBA")) for input_path, _ in paths]
+    total = sum(frame.shape[0] * frame.shape[1] for frame in frames)
+    if incremental is not None:
+        matting = IncrementalMatting(_backend, **incremental)
+        results = [matting.matte(frame) for frame in frames]
+        recomputed = matting.recomputed
+    else:
+        results = [None] * len(frames)
+        for shape in {frame.shape for frame in frames}:
+            indexes = [index for index, frame in enumerate(frames) if frame.shape == shape]
+            for index, result in zip(indexes, _backend.matte_batch(np.stack([frames[index] for index in indexes]))):
+                results[index] = result
+        recomputed = total
+    hashes = [_write_frame(output_path, result) for (_, output_path), result in zip(paths, results)]
+    return hashes, recomputed, total
+
+
+def _write_frame(output_path, rgba):
+    buffer = io.BytesIO()
+    Image.fromarray(rgba).convert("RGBA").save(buffer, format="PNG")
+    data = buffer.getvalue()
+    with open(output_path + ".tmp", "wb") as file:
+        file.write(data)
+    os.replace(output_path + ".tmp", output_path)
+    return content_hash(data)
+
+
+def _output_hash(path):
+    try:
+        with open(path, "rb") as file:
+            return content_hash(file.read())
+    except OSError:
+        return None
+
+
+# Matte every frame of input_folder into output_folder on a pool of worker
+# processes, batch_size frames at a time. Frames already matted from the same
+# input with the same backend settings are skipped unless force is set. options
+# are passed to the backend. With incremental settings every batch of
+# keyframe_interval consecutive frames is matted by IncrementalMatting.
+# Returns (processed, skipped).
+def remove_backgrounds(input_folder, output_folder, backend_name="rembg", options=None, workers=None, batch_size=8,
+                       force=False, incremental=None, log=print):
+    os.makedirs(output_folder, exist_ok=True)
+    options = options or {}
+    backend_settings = BACKENDS[backend_name](**options).settings()
+    if incremental is not None:
+        if not BACKENDS[backend_name].local:
+            raise ValueError(f"{backend_name} looks at the whole frame and cannot matte incrementally")
+        incremental = IncrementalMatting(None, **incremental).settings()
+        backend_settings = {**backend_settings, "incremental": incremental}
+        batch_size = incremental["keyframe_interval"]
+    state = {} if force else read_state(output_folder)
+
+    pending = {}
+    skipped = 0
+    for filename in list_frames(input_folder):
+        with open(os.path.join(input_folder, filename), "rb") as file:
+            key = state_key(backend_name, backend_settings, content_hash(file.read()))
+        output_path = os.path.join(output_folder, filename)
+        entry = state.get(filename)
+        if entry and entry["key"] == key and entry["output"] == _output_hash(output_path):
+            skipped += 1
+        else:
+            pending[filename] = key
+    log(f"{len(pending)} frames to matte with {backend_name}, {skipped} up to date")
+    if not pending:
+        return 0, skipped
+
+    processed = 0
+    recomputed = 0
+    total = 0
+    try:
+        filenames = list(pending)
+        batches = [filenames[start:start + batch_size] for start in range(0, len(filenames), batch_size)]
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(backend_name, options)) as executor:
+            futures = {executor.submit(_matte_frames, [(os.path.join(input_folder, filename),
+                                                        os.path.join(output_folder, filename))
+                                                       for filename in batch], incremental): batch
+                       for batch in batches}
+            for future in as_completed(futures):
+                batch = futures[future]
+                hashes, batch_recomputed, batch_total = future.result()
+                for filename, output_hash in zip(batch, hashes):
+                    state[filename] = {"key": pending[filename], "output": output_hash}
+                recomputed += batch_recomputed
+                total += batch_total
+                saved_before = processed // STATE_SAVE_EVERY
+                processed += len(batch)
+                log(f"Matted {batch[-1]} ({processed}/{len(pending)})")
+                if processed // STATE_SAVE_EVERY > saved_before:
+                    write_state(output_folder, state)
+    finally:
+        write_state(output_folder, state)
+    if incremental is not None and total:
+        log(f"Recomputed {recomputed / total:.1%} of the pixels")
+    return processed, skipped
+
+
+# Settings of backend_name from NAME=VALUE command line values, a malformed or
+# rejected setting exits through parser.error
+def parse_options(parser, backend_name, values):
+    options = {}
+    for option in values:
+        name, separator, value = option.partition("=")
+        if not separator:
+            parser.error(f"--option needs NAME=VALUE, got {option}")
+        options[name] = value
+    try:
+        BACKENDS[backend_name](**options)
+    except (TypeError, ValueError) as error:
+        parser.error(f"invalid option for {backend_name}: {error}")
+    return options
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove the background of every frame in a folder")
+    parser.add_argument("input_folder", nargs="?", default="img")
+    parser.add_argument("output_folder", nargs="?", default="outp")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=RembgBackend.name)
+    parser.add_argument("--option", action="append", default=[], metavar="NAME=VALUE",
+                        help="backend setting, e.g. --option key_color=#00b140 --option tolerance=15")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to the CPU count")
+    parser.add_argument("--batch-size", type=int, default=8, help="frames matted together by a worker")
+    parser.add_argument("--force", action="store_true", help="matte every frame again")
+    parser.add_argument("--incremental", action="store_true",
+                        help="matte again only where the frame changed and carry the previous mask elsewhere, "
+                             "for backends that work pixel by pixel")
+    parser.add_argument("--change-threshold", type=int, default=8,
+                        help="per channel difference (0-255) below which a pixel counts as unchanged")
+    parser.add_argument("--keyframe-interval", type=int, default=30, help="frames between whole frame mattes")
+    parser.add_argument("--padding", type=int, default=16,
+                        help="pixels matted again around every change, at least the backend's reach")
+    args = parser.parse_args()
+
+    options = parse_options(parser, args.backend, args.option)
+
+    incremental = None
+    if args.incremental:
+        if not BACKENDS[args.backend].local:
+            local = ", ".join(name for name, backend in sorted(BACKENDS.items()) if backend.local)
+            parser.error(f"--incremental needs a backend that works pixel by pixel: {local}")
+        incremental = {"threshold": args.change_threshold, "padding": args.padding,
+                       "keyframe_interval": args.keyframe_interval}
+    processed, skipped = remove_backgrounds(args.input_folder, args.output_folder, args.backend, options,
+                                            args.workers, args.batch_size, args.force, incremental)
+    print(f"Matted {processed} frames, skipped {skipped} up to date frames")
@@ -0,0 +1,299 @@
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import os
+import numpy as np
+import assets
+from bg import BACKENDS, parse_options
+from framepack import (DEFAULT_KEYFRAME_INTERVAL, FLAG_DELTA, FLAG_KEYFRAME, LooseFrames, content_hash, write_folder,
+                       write_pack)
+
+# Asset build from raw captures to the frames the player loads, as a graph of
+# stages: decode, matte, trim, dedup, quantize and pack. Every intermediate is
+# stored in the cache directory under a hash of its inputs and the stage
+# parameters, so changing a parameter rebuilds only the stages after it and
+# only for the frames whose inputs changed. Per frame stages run on a process
+# pool.
+CACHE_DIR = ".asset_cache"
+PALETTE_COLORS = 256
+
+
+def stage_key(stage, params, *inputs):
+    return content_hash(json.dumps([stage, params, inputs], sort_keys=True).encode())
+
+
+# Intermediates by key, arrays as .npy, metadata as .json and encoded frames
+# as .bin. Files are written to a temporary name and renamed, a file that
+# exists is complete.
+class ArtifactCache:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def has(self, key, suffix):
+        return os.path.exists(self.path(key, suffix))
+
+    def load_array(self, key):
+        return np.load(self.path(key, ".npy"), allow_pickle=False)
+
+    def save_array(self, key, array):
+        with self._writer(key, ".npy") as file:
+            np.save(file, array, allow_pickle=False)
+
+    def load_json(self, key):
+        with open(self.path(key, ".json")) as file:
+            return json.load(file)
+
+    def save_json(self, key, value):
+        with self._writer(key, ".json", "w") as file:
+            json.dump(value, file)
+
+    def load_bytes(self, key):
+        with open(self.path(key, ".bin"), "rb") as file:
+            return file.read()
+
+    def save_bytes(self, key, data):
+        with self._writer(key, ".bin") as file:
+            file.write(data)
+
+    def _writer(self, key, suffix, mode="wb"):
+        return _AtomicFile(self.path(key, suffix), mode)
+
+
+class _AtomicFile:
+    def __init__(self, path, mode):
+        self.path = path
+        self.file = open(path + f".{os.getpid()}.tmp", mode)
+
+    def __enter__(self):
+        return self.file
+
+    def __exit__(self, error_type, error, traceback):
+        self.file.close()
+        if error_type is None:
+            os.replace(self.file.name, self.path)
+        else:
+            os.remove(self.file.name)
+
+
+# Per frame stages, run in the worker processes. Each reads its inputs from the
+# cache and stores its output under key.
+
+def _decode(cache_dir, key, data, canvas_size):
+    image = assets.open_frame(data)
+    ArtifactCache(cache_dir).save_array(key, assets.canvas_array(image, (0, 0, *image.size), canvas_size))
+
+
+# The matting backend of a worker, built on first use
+_backends = {}
+
+
+def _matte(cache_dir, key, input_key, backend_name, options):
+    backend_id = json.dumps([backend_name, options], sort_keys=True)
+    if backend_id not in _backends:
+        _backends[backend_id] = BACKENDS[backend_name](**options)
+        _backends[backend_id].load()
+    cache = ArtifactCache(cache_dir)
+    cache.save_array(key, _backends[backend_id].matte(cache.load_array(input_key)))
+
+
+def _trim(cache_dir, key, input_key):
+    cache = ArtifactCache(cache_dir)
+    canvas = cache.load_array(input_key)
+    cache.save_json(key, assets.index_bbox(canvas[..., 3]))
+
+
+# Palette indices of a frame, and as metadata how close they come to the frame
+# in PSNR
+def _quantize(cache_dir, key, input_key, palette_key):
+    cache = ArtifactCache(cache_dir)
+    canvas = cache.load_array(input_key)
+    palette = cache.load_array(palette_key)
+    indices = assets.quantize_canvas(canvas, palette)
+    cache.save_json(key, assets.psnr(canvas, assets.expand(indices, palette)))
+    cache.save_array(key, indices)
+
+
+# Encoded payload of one frame: the PNG of its bounding box, or with a
+# previous frame the delta patches against it and their union as bounding box
+def _encode(cache_dir, key, input_key, bbox, previous_key):
+    cache = ArtifactCache(cache_dir)
+    canvas = cache.load_array(input_key)
+    if previous_key is not None:
+        rects = assets.changed_rects(cache.load_array(previous_key), canvas)
+        cache.save_json(key, assets.union_rect(rects))
+        cache.save_bytes(key, assets.encode_delta(canvas, rects))
+        return
+    x, y, w, h = bbox
+    crop = np.ascontiguousarray(canvas[y:y + h, x:x + w])
+    data = assets.encode_indices(crop) if canvas.ndim == 2 else assets.encode_png(Image.fromarray(crop))
+    cache.save_json(key, bbox)
+    cache.save_bytes(key, data)
+
+
+# Run the jobs of a per frame stage whose output is not cached yet, a job is
+# (key, function, arguments). Returns the keys in job order.
+def _run_stage(executor, cache, stages, name, suffix, jobs):
+    missing = [(function, arguments) for key, function, arguments in jobs if not cache.has(key, suffix)]
+    for future in [executor.submit(function, *arguments) for function, arguments in missing]:
+        future.result()
+    stages[name] = {"built": len(missing), "cached": len(jobs) - len(missing)}
+    return [key for key, _, _ in jobs]
+
+
+# Build the frames of input_folder into every output path, a .pack file or a
+# folder with a manifest. matte names a bg.py backend, matte_options are its
+# settings. Returns a report of how many frames every stage built and reused,
+# the size of the frames against the source and with quantize the palette's
+# PSNR.
+def build_assets(input_folder, outputs, cache_dir=CACHE_DIR, workers=None, matte=None, matte_options=None,
+                 trim=False, dedup=False, dedup_threshold=0.0, quantize=False, delta=False,
+                 keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+    for output in outputs:
+        if not output.endswith(".pack") and os.path.abspath(output) == os.path.abspath(input_folder):
+            raise ValueError("Writing the built frames over the source frames would destroy them")
+    cache = ArtifactCache(cache_dir)
+    source = LooseFrames(input_folder)
+    canvas_size = source.canvas_size
+    count = len(source)
+    delays = [source.delay(index) for index in range(count)]
+    names = list(source.names)
+    stages = {}
+    report = {"stages": stages, "source_frames": count, "source_bytes": sum(len(data) for data in source),
+              "quality": None}
+
+    with ProcessPoolExecutor(workers) as executor:
+        keys = [stage_key("decode", canvas_size, content_hash(bytes(source[index]))) for index in range(count)]
+        _run_stage(executor, cache, stages, "decode", ".npy",
+                   [(key, _decode, (cache_dir, key, bytes(source[index]), canvas_size))
+                    for index, key in enumerate(keys)])
+
+        if matte:
+            matte_options = matte_options or {}
+            params = [matte, BACKENDS[matte](**matte_options).settings()]
+            keys = _run_stage(executor, cache, stages, "matte", ".npy",
+                              [(stage_key("matte", params, key), _matte,
+                                (cache_dir, stage_key("matte", params, key), key, matte, matte_options))
+                               for key in keys])
+
+        bboxes = [(0, 0, *canvas_size)] * count
+        if trim:
+            trim_keys = _run_stage(executor, cache, stages, "trim", ".json",
+                                   [(stage_key("trim", None, key), _trim, (cache_dir, stage_key("trim", None, key), key))
+                                    for key in keys])
+            bboxes = [tuple(cache.load_json(key)) for key in trim_keys]
+
+        if dedup:
+            dedup_key = stage_key("dedup", dedup_threshold, keys, delays)
+            stages["dedup"] = {"built": 0, "cached": 1}
+            if not cache.has(dedup_key, ".json"):
+                # Canvases are loaded one at a time as the comparison walks the sequence
+                kept = assets.dedup_frames((cache.load_array(key) for key in keys), delays, dedup_threshold)
+                cache.save_json(dedup_key, kept)
+                stages["dedup"] = {"built": 1, "cached": 0}
+            kept = cache.load_json(dedup_key)
+            keys = [keys[index] for index, _ in kept]
+            bboxes = [bboxes[index] for index, _ in kept]
+            names = [names[index] for index, _ in kept]
+            delays = [delay for _, delay in kept]
+
+        palette = None
+        if quantize:
+            # The palette samples frames by position, so it depends on their order
+            unique_keys = list(dict.fromkeys(keys))
+            palette_key = stage_key("palette", PALETTE_COLORS, unique_keys)
+            stages["palette"] = {"built": 0, "cached": 1}
+            if not cache.has(palette_key, ".npy"):
+                # Only the frames the palette samples pixels from are loaded
+                canvases = [cache.load_array(key) for key in assets.palette_samples(unique_keys)]
+                cache.save_array(palette_key, assets.build_palette(canvases, PALETTE_COLORS))
+                stages["palette"] = {"built": 1, "cached": 0}
+            palette = assets.palette_argb(cache.load_array(palette_key))
+            keys = _run_stage(executor, cache, stages, "quantize", ".npy",
+                              [(stage_key("quantize", None, palette_key, key), _quantize,
+                                (cache_dir, stage_key("quantize", None, palette_key, key), key, palette_key))
+                               for key in keys])
+            scores = [cache.load_json(key) for key in keys]
+            finite = [score for score in scores if score != float("inf")] or [float("inf")]
+            report["quality"] = {"psnr_min": min(finite), "psnr_mean": sum(finite) / len(finite)}
+
+        jobs = []
+        for index, key in enumerate(keys):
+            previous_key = keys[index - 1] if delta and index % keyframe_interval else None
+            encode_key = stage_key("encode", None, key, bboxes[index], previous_key)
+            jobs.append((encode_key, _encode, (cache_dir, encode_key, key, bboxes[index], previous_key)))
+        encode_keys = _run_stage(executor, cache, stages, "pack", ".bin", jobs)
+
+    frames = []
+    for index, key in enumerate(encode_keys):
+        if delta:
+            flags = FLAG_DELTA if index % keyframe_interval else FLAG_KEYFRAME
+        else:
+            flags = 0
+        frames.append((cache.load_bytes(key), delays[index], tuple(cache.load_json(key)), flags))
+        if flags == FLAG_DELTA:
+            names[index] = os.path.splitext(names[index])[0] + ".delta"
+    shared_bytes = 0
+    for output in outputs:
+        if output.endswith(".pack"):
+            shared_bytes = write_pack(output, frames, canvas_size, palette)
+        else:
+            shared_bytes = write_folder(output, names, frames, canvas_size, palette)
+    report["frames"] = len(frames)
+    report["shared_bytes"] = shared_bytes
+    report["bytes"] = sum(len(data) for data, _, _, _ in frames) - shared_bytes
+    return report
+
+
+# Lines describing what dedup saved and how close the palette came, for the
+# stages that ran
+def summary_lines(report):
+    lines = []
+    if "dedup" in report["stages"]:
+        lines.append(f"Dedup removed {report['source_frames'] - report['frames']} of {report['source_frames']} frames, "
+                     f"shared {report['shared_bytes'] / 1024:.0f} KB between identical frames, "
+                     f"{(report['source_bytes'] - report['bytes']) / 1024:.0f} KB smaller than the source images")
+    if report["quality"]:
+        quality = report["quality"]
+        lines.append(f"Palette quality: {quality['psnr_mean']:.1f} dB mean PSNR, {quality['psnr_min']:.1f} dB worst frame")
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the player's frames from raw captures")
+    parser.add_argument("input_folder")
+    parser.add_argument("outputs", nargs="+", help="frame packs or folders to write the frames and a manifest to")
+    parser.add_argument("--cache", default=CACHE_DIR, help="directory for the intermediate results")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to the CPU count")
+    parser.add_argument("--matte", choices=sorted(BACKENDS), help="remove the background with this backend")
+    parser.add_argument("--option", action="append", default=[], metavar="NAME=VALUE", help="matting backend setting")
+    parser.add_argument("--trim", action="store_true", help="crop frames to their visible pixels")
+    parser.add_argument("--dedup", action="store_true", help="collapse duplicate frames")
+    parser.add_argument("--dedup-threshold", type=float, default=0.0,
+                        help="mean thumbnail difference (0-1) below which frames count as duplicates")
+    parser.add_argument("--quantize", action="store_true", help="store frames as indices into one shared palette")
+    parser.add_argument("--delta", action="store_true", help="store changed rectangles between keyframes")
+    parser.add_argument("--keyframe-interval", type=int, default=DEFAULT_KEYFRAME_INTERVAL)
+    args = parser.parse_args()
+
+    options = {}
+    if args.matte:
+        options = parse_options(parser, args.matte, args.option)
+    elif args.option:
+        parser.error("--option sets the matting backend and needs --matte")
+
+    try:
+        report = build_assets(args.input_folder, args.outputs, args.cache, args.workers, args.matte, options,
+                              args.trim, args.dedup, args.dedup_threshold, args.quantize, args.delta,
+                              args.keyframe_interval)
+    except ValueError as error:
+        parser.error(str(error))
+    for stage, counts in report["stages"].items():
+        print(f"{stage}: built {counts['built']}, reused {counts['cached']}")
+    print(f"Wrote {report['frames']} frames to {', '.join(args.outputs)}")
+    for line in summary_lines(report):
+        print(line)
@@ -0,0 +1,198 @@
+import hashlib
+import mmap
+import os
+import struct
+from PySide6.QtGui import QImage
+
+# Decoded frames kept on disk between launches, so a warm start reads raw
+# pixels instead of decoding PNGs again. Each asset set gets one file named
+# after a hash of its content:
+#   header: magic, version, reserved, frame count
+#   entry:  data offset, QImage format, width, height, bytes per line
+# followed by the pixel data of every frame, each frame 64 byte aligned.
+# Every page of the map that playback touched stays resident, so a set plays
+# from the cache at up to its whole size in memory. The limit keeps that to
+# trimmed frame sets, untrimmed sets of full canvases play from their
+# compressed frames within the decoded frame budget instead.
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".bailando_cache")
+CACHE_LIMIT_MB = int(os.environ.get("BAILANDO_DISK_CACHE_MB", "256"))
+RAW_MAGIC = b"BLDR"
+RAW_VERSION = 1
+RAW_HEADER = struct.Struct("<4sHHI")
+RAW_ENTRY = struct.Struct("<QIHHI")
+RAW_SUFFIX = ".frames"
+ALIGNMENT = 64
+
+
+# Hash of everything that decides what the decoded frames look like. Bundled
+# builds extract to a new folder with fresh mtimes on every launch, so the
+# content is hashed rather than trusting mtime and size. Frames listed in a
+# manifest come with their hashes already.
+def source_key(source):
+    digest = hashlib.blake2b(digest_size=16)
+    if getattr(source, "hashes", None):
+        digest.update(" ".join(source.hashes).encode())
+    else:
+        for index in range(len(source)):
+            digest.update(struct.pack("<I", len(source[index])))
+            digest.update(source[index])
+    if getattr(source, "palette", None):
+        digest.update(struct.pack(f"<{len(source.palette)}I", *source.palette))
+    return digest.hexdigest()
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+# Raw decoded frames of one cache file, with the frame metadata of the source
+# they were decoded from. Frames are QImages built directly over the memory
+# map, nothing is copied: painting reads the page cache, only the pages of
+# frames actually shown become resident and the OS reclaims them as needed.
+class RawFrames:
+    mapped = True
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.canvas_size = source.canvas_size
+        self.palette = source.palette
+        with open(path, "rb") as file:
+            self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, count = RAW_HEADER.unpack_from(self._mm, 0)
+        if magic != RAW_MAGIC or version != RAW_VERSION or count != len(source):
+            self.close()
+            raise ValueError(f"{path} does not match the frames")
+        self.entries = [RAW_ENTRY.unpack_from(self._mm, RAW_HEADER.size + i * RAW_ENTRY.size) for i in range(count)]
+        offset, _, _, height, bytes_per_line = self.entries[-1]
+        if offset + height * bytes_per_line > len(self._mm):
+            self.close()
+            raise ValueError(f"{path} is truncated")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        return self.source[index]
+
+    def delay(self, index):
+        return self.source.delay(index)
+
+    def bbox(self, index):
+        return self.source.bbox(index)
+
+    def flags(self, index):
+        return self.source.flags(index)
+
+    def decode(self, index):
+        offset, image_format, width, height, bytes_per_line = self.entries[index]
+        # The image holds a reference to its slice of the map, which keeps the
+        # map alive for as long as the frame is in use
+        data = memoryview(self._mm)[offset:offset + height * bytes_per_line]
+        image = QImage(data, width, height, bytes_per_line, QImage.Format(image_format))
+        if image.format() == QImage.Format_Indexed8:
+            image.setColorTable(self.palette)
+        return image
+
+    def close(self):
+        try:
+            self._mm.close()
+        except BufferError:
+            # Frames still in use unmap it once they are freed
+            pass
+
+
+class FrameDiskCache:
+    def __init__(self, directory=CACHE_DIR, limit_bytes=CACHE_LIMIT_MB * 1024 * 1024):
+        self.directory = directory
+        self.limit_bytes = limit_bytes
+
+    def path(self, key):
+        return os.path.join(self.directory, key + RAW_SUFFIX)
+
+    # Raw frames for key, or None when there is no valid cache file for it
+    def open(self, key, source):
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            frames = RawFrames(path, source)
+        except (OSError, ValueError, struct.error):
+            os.remove(path)
+            return None
+        os.utime(path)  # Most recently used asset set survives eviction longest
+        return frames
+
+    # Decode every frame with decode(index) and write them under key, frames
+    # are written one at a time and the index is filled in at the end. Gives up
+    # when cancelled() turns true.
+    def store(self, key, source, decode, cancelled=lambda: False):
+        if not self.fits(source):
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        temp_path = path + ".tmp"
+        entries = []
+        offset = _aligned(RAW_HEADER.size + RAW_ENTRY.size * len(source))
+        with open(temp_path, "wb") as file:
+            for index in range(len(source)):
+                if cancelled():
+                    break
+                image = decode(index)
+                if offset + image.sizeInBytes() > self.limit_bytes:
+                    break
+                file.seek(offset)
+                file.write(image.constBits())
+                entries.append(RAW_ENTRY.pack(offset, image.format().value, image.width(), image.height(),
+                                              image.bytesPerLine()))
+                offset = _aligned(offset + image.sizeInBytes())
+            file.seek(0)
+            file.write(RAW_HEADER.pack(RAW_MAGIC, RAW_VERSION, 0, len(source)))
+            file.writelines(entries)
+        if len(entries) < len(source):
+            # Cancelled, or decoded larger than the frame sizes promised
+            os.remove(temp_path)
+            return None
+        os.replace(temp_path, path)
+        self.evict(keep=key)
+        return path
+
+    def fits(self, source):
+        return self.required_bytes(source) <= self.limit_bytes
+
+    # Size of the cache file for source, frames decode to 32-bit pixels of
+    # their bounding box
+    def required_bytes(self, source):
+        offset = _aligned(RAW_HEADER.size + RAW_ENTRY.size * len(source))
+        for index in range(len(source)):
+            _, _, width, height = source.bbox(index)
+            offset = _aligned(offset + width * height * 4)
+        return offset
+
+    # Remove other asset versions, least recently used first, until the cache
+    # fits in its limit again
+    def evict(self, keep=None):
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+            elif name.endswith(RAW_SUFFIX):
+                files.append((os.path.getmtime(path), os.path.getsize(path), path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.limit_bytes:
+                break
+            if path != self.path(keep):
+                os.remove(path)
+                total -= size
+
+    def clear(self):
+        if not os.path.isdir(self.directory):
+            return 0
+        removed = 0
+        for name in os.listdir(self.directory):
+            if name.endswith(RAW_SUFFIX) or name.endswith(".tmp"):
+                os.remove(os.path.join(self.directory, name))
+                removed += 1
+        return removed
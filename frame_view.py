@@ -0,0 +1,49 @@
+from PySide6.QtWidgets import QWidget
+from PySide6.QtGui import QImage, QPainter
+from PySide6.QtCore import Qt, QPoint, QRect, QSize
+
+
+# Widget that paints the current frame straight from a QImage. Swapping frames
+# only invalidates the area covered by the old and new frame, there is no
+# pixmap conversion, size hint or style sheet work on the way.
+class FrameView(QWidget):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setAttribute(Qt.WA_TranslucentBackground)
+        self.setAttribute(Qt.WA_NoSystemBackground)
+        self.frame = None
+        self.frame_rect = QRect()
+
+    def sizeHint(self):
+        return QSize(500, 281)
+
+    def set_frame(self, image, offset=QPoint(0, 0)):
+        # Frames are converted when they are decoded, never while painting
+        assert image.format() == QImage.Format_ARGB32_Premultiplied, image.format()
+        rect = QRect(offset, image.size())
+        dirty = self.frame_rect.united(rect)
+        self.frame = image
+        self.frame_rect = rect
+        self.update(dirty)
+
+    # Show a back buffer that was updated in place, only the given rectangles
+    # are repainted
+    def set_canvas(self, image, rects):
+        assert image.format() == QImage.Format_ARGB32_Premultiplied, image.format()
+        self.frame = image
+        self.frame_rect = image.rect()
+        for rect in rects:
+            self.update(rect)
+
+    def paintEvent(self, event):
+        if self.frame is None:
+            return
+        painter = QPainter(self)
+        # The translucent backing store is already cleared, copy the pixels
+        # instead of blending them
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        for rect in event.region():
+            target = rect.intersected(self.frame_rect)
+            if not target.isEmpty():
+                painter.drawImage(target, self.frame, target.translated(-self.frame_rect.topLeft()))
+        painter.end()
@@ -0,0 +1,330 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+
+# Packed frame archive: a header, an index with one entry per frame, an
+# optional shared palette and then the PNG data of every frame back to back.
+#   header: magic, version, pack flags, frame count, canvas width, canvas height
+#   entry:  data offset, data length, delay in ms, bounding box x, y, w, h, flags
+PACK_MAGIC = b"BLDP"
+PACK_VERSION = 1
+HEADER = struct.Struct("<4sHHIHH")
+ENTRY = struct.Struct("<QIHHHHHH")
+
+# Pack flags. With a palette the frames are 8-bit greyscale PNGs of palette
+# indices and the 256 0xAARRGGBB palette colours follow the index.
+PACK_HAS_PALETTE = 1
+PALETTE = struct.Struct("<256I")
+
+# Entry flags. A keyframe holds a whole frame, a delta frame holds only the
+# patches that changed since the previous frame and its bounding box is the
+# union of the patches.
+FLAG_KEYFRAME = 1
+FLAG_DELTA = 2
+
+# Delta frame payload: patch count, then x, y, w, h and PNG length of every
+# patch, then the PNG data of the patches
+PATCH_COUNT = struct.Struct("<H")
+PATCH = struct.Struct("<HHHHI")
+DEFAULT_KEYFRAME_INTERVAL = 30
+
+# Manifest of a frame folder written by the asset build: canvas size, shared
+# palette and every frame in play order with its file, delay, bounding box,
+# flags, content hash, byte size and the earlier frame it shares data with
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+DELAY_PATTERN = re.compile(r"_delay-([0-9.]+)s", re.IGNORECASE)
+DEFAULT_DELAY_MS = 30
+
+
+# Frame delay in milliseconds from a name like frame_0001_delay-0.04s.png
+def parse_delay(filename):
+    match = DELAY_PATTERN.search(filename)
+    if not match:
+        return DEFAULT_DELAY_MS
+    return round(float(match.group(1)) * 1000)
+
+
+# Width and height from the IHDR chunk of a PNG
+def png_size(data):
+    if data[:8] != b"\x89PNG\r\n\x1a\n":
+        raise ValueError("Not a PNG file")
+    return struct.unpack(">II", data[16:24])
+
+
+# Split a delta payload into ((x, y, w, h), png bytes) patches
+def read_patches(payload):
+    count, = PATCH_COUNT.unpack_from(payload, 0)
+    offset = PATCH_COUNT.size + PATCH.size * count
+    patches = []
+    for i in range(count):
+        x, y, w, h, length = PATCH.unpack_from(payload, PATCH_COUNT.size + i * PATCH.size)
+        patches.append(((x, y, w, h), payload[offset:offset + length]))
+        offset += length
+    return patches
+
+
+def list_frames(image_folder):
+    return sorted(f for f in os.listdir(image_folder) if f.lower().endswith('.png'))
+
+
+# Write frames to a pack, each frame is (png bytes, delay ms, (x, y, w, h), flags).
+# Frames with identical data share one copy, returns the bytes saved that way.
+def write_pack(output_path, frames, canvas_size, palette=None):
+    offset = HEADER.size + ENTRY.size * len(frames) + (PALETTE.size if palette else 0)
+    entries = []
+    blobs = []
+    offsets = {}
+    shared_bytes = 0
+    for data, delay, (x, y, w, h), flags in frames:
+        if data in offsets:
+            shared_bytes += len(data)
+        else:
+            offsets[data] = offset
+            blobs.append(data)
+            offset += len(data)
+        entries.append(ENTRY.pack(offsets[data], len(data), delay, x, y, w, h, flags))
+
+    temp_path = output_path + ".tmp"
+    with open(temp_path, "wb") as file:
+        file.write(HEADER.pack(PACK_MAGIC, PACK_VERSION, PACK_HAS_PALETTE if palette else 0, len(frames), *canvas_size))
+        file.writelines(entries)
+        if palette:
+            file.write(PALETTE.pack(*palette))
+        file.writelines(blobs)
+    os.replace(temp_path, output_path)
+    return shared_bytes
+
+
+def content_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+# Write frames to a folder with a manifest, each frame is (data, delay ms,
+# (x, y, w, h), flags) stored under the matching name. Frames with identical
+# data share the first frame's file, files that already hold the same data are
+# left alone. Returns the bytes saved by sharing.
+def write_folder(output_folder, names, frames, canvas_size, palette=None):
+    os.makedirs(output_folder, exist_ok=True)
+    first_by_hash = {}
+    manifest_frames = []
+    shared_bytes = 0
+    for index, (name, (data, delay, bbox, flags)) in enumerate(zip(names, frames)):
+        digest = content_hash(data)
+        shared = first_by_hash.setdefault(digest, index)
+        if shared != index:
+            shared_bytes += len(data)
+            name = manifest_frames[shared]["file"]
+        else:
+            _write_if_changed(os.path.join(output_folder, name), data)
+        manifest_frames.append({
+            "file": name,
+            "delay_ms": delay,
+            "bbox": list(bbox),
+            "flags": flags,
+            "hash": digest,
+            "bytes": len(data),
+            "shared": shared if shared != index else None,
+        })
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "canvas_size": list(canvas_size),
+        "palette": palette,
+        "frames": manifest_frames,
+    }
+    manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+    with open(manifest_path + ".tmp", "w") as file:
+        json.dump(manifest, file, separators=(",", ":"))
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return shared_bytes
+
+
+def _write_if_changed(path, data):
+    if os.path.exists(path) and os.path.getsize(path) == len(data):
+        with open(path, "rb") as file:
+            if file.read() == data:
+                return
+    with open(path + ".tmp", "wb") as file:
+        file.write(data)
+    os.replace(path + ".tmp", path)
+
+
+# Build a pack from an img directory, with trim every frame is cropped to the
+# bounding box of its visible pixels and drawn at the stored offset. With delta
+# only every keyframe_interval-th frame is stored whole, the frames in between
+# store the rectangles that changed since the frame before them. With dedup
+# runs of identical frames, or frames within dedup_threshold of each other,
+# become one frame with their delays summed, and identical frames further
+# apart share their data. With quantize every frame is mapped to one shared
+# 256 colour palette and stored as palette indices. These options run as the
+# cached stages of build_assets.py. An output path that does not end in .pack
+# is written as a folder of frame files with a manifest instead. Returns a
+# report of what was written.
+def build_pack(image_folder, output_path, trim=False, delta=False, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL,
+               dedup=False, dedup_threshold=0.0, quantize=False):
+    pack = output_path.endswith(".pack")
+    if trim or delta or dedup or quantize:
+        # build_assets imports this module
+        from build_assets import build_assets
+        report = build_assets(image_folder, [output_path], trim=trim, dedup=dedup, dedup_threshold=dedup_threshold,
+                              quantize=quantize, delta=delta, keyframe_interval=keyframe_interval)
+        if pack:
+            report["bytes"] = os.path.getsize(output_path)
+        return report
+
+    image_files = list_frames(image_folder)
+    frames = []
+    for image_file in image_files:
+        with open(os.path.join(image_folder, image_file), "rb") as file:
+            data = file.read()
+        frames.append((data, parse_delay(image_file), (0, 0, *png_size(data)), 0))
+    canvas_size = (max((w for _, _, (_, _, w, _), _ in frames), default=0),
+                   max((h for _, _, (_, _, _, h), _ in frames), default=0))
+    if pack:
+        shared_bytes = write_pack(output_path, frames, canvas_size)
+        output_bytes = os.path.getsize(output_path)
+    else:
+        shared_bytes = write_folder(output_path, image_files, frames, canvas_size)
+        output_bytes = sum(len(data) for data, _, _, _ in frames) - shared_bytes
+    return {
+        "stages": {},
+        "source_frames": len(frames),
+        "source_bytes": sum(len(data) for data, _, _, _ in frames),
+        "frames": len(frames),
+        "bytes": output_bytes,
+        "shared_bytes": shared_bytes,
+        "quality": None,
+    }
+
+
+# Read only view of a pack, frame data is sliced straight out of a memory map
+class FramePack:
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, pack_flags, count, width, height = HEADER.unpack_from(self._mm, 0)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            self._mm.close()
+            raise ValueError(f"{path} is not a version {PACK_VERSION} frame pack")
+        self.canvas_size = (width, height)
+        self.entries = [ENTRY.unpack_from(self._mm, HEADER.size + i * ENTRY.size) for i in range(count)]
+        self.palette = None
+        if pack_flags & PACK_HAS_PALETTE:
+            self.palette = list(PALETTE.unpack_from(self._mm, HEADER.size + count * ENTRY.size))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        offset, length = self.entries[index][:2]
+        return self._mm[offset:offset + length]
+
+    def delay(self, index):
+        return self.entries[index][2]
+
+    def bbox(self, index):
+        return self.entries[index][3:7]
+
+    def flags(self, index):
+        return self.entries[index][7]
+
+    def close(self):
+        self._mm.close()
+
+
+# Loose frame files of an img directory behind the same interface as
+# FramePack, the compressed bytes of every frame are read once. Frames come
+# from the folder's manifest when the asset build wrote one, otherwise from
+# the PNG files in name order with the delay parsed from their names.
+class LooseFrames:
+    def __init__(self, image_folder):
+        self.data = []
+        self.names = []
+        self.entries = []
+        self.hashes = None
+        self.canvas_size = (0, 0)
+        self.palette = None
+        manifest_path = os.path.join(image_folder, MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            self._read_manifest(image_folder, manifest_path)
+            return
+        for image_file in list_frames(image_folder):
+            with open(os.path.join(image_folder, image_file), "rb") as file:
+                data = file.read()
+            width, height = png_size(data)
+            self.canvas_size = (max(self.canvas_size[0], width), max(self.canvas_size[1], height))
+            self.data.append(data)
+            self.names.append(image_file)
+            self.entries.append((0, len(data), parse_delay(image_file), 0, 0, width, height, 0))
+
+    def _read_manifest(self, image_folder, manifest_path):
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"{manifest_path} is not a version {MANIFEST_VERSION} manifest")
+        self.canvas_size = tuple(manifest["canvas_size"])
+        self.palette = manifest["palette"]
+        self.hashes = []
+        for frame in manifest["frames"]:
+            if frame["shared"] is not None:
+                data = self.data[frame["shared"]]
+            else:
+                with open(os.path.join(image_folder, frame["file"]), "rb") as file:
+                    data = file.read()
+            if len(data) != frame["bytes"]:
+                raise ValueError(f"{frame['file']} does not match {manifest_path}, rebuild the frames")
+            self.data.append(data)
+            self.names.append(frame["file"])
+            self.entries.append((0, len(data), frame["delay_ms"], *frame["bbox"], frame["flags"]))
+            self.hashes.append(frame["hash"])
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def delay(self, index):
+        return self.entries[index][2]
+
+    def bbox(self, index):
+        return self.entries[index][3:7]
+
+    def flags(self, index):
+        return self.entries[index][7]
+
+    def close(self):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack an img directory into a single frame archive")
+    parser.add_argument("image_folder", nargs="?", default="img")
+    parser.add_argument("output", nargs="?", default="frames.pack",
+                        help="frame pack, or a folder to write the frames and a manifest to")
+    parser.add_argument("--trim", action="store_true", help="crop frames to their visible pixels")
+    parser.add_argument("--delta", action="store_true", help="store changed rectangles between keyframes")
+    parser.add_argument("--keyframe-interval", type=int, default=DEFAULT_KEYFRAME_INTERVAL)
+    parser.add_argument("--dedup", action="store_true", help="collapse duplicate frames")
+    parser.add_argument("--dedup-threshold", type=float, default=0.0,
+                        help="mean thumbnail difference (0-1) below which frames count as duplicates")
+    parser.add_argument("--quantize", action="store_true", help="store frames as indices into one shared palette")
+    args = parser.parse_args()
+
+    try:
+        report = build_pack(args.image_folder, args.output, trim=args.trim, delta=args.delta,
+                            keyframe_interval=args.keyframe_interval, dedup=args.dedup,
+                            dedup_threshold=args.dedup_threshold, quantize=args.quantize)
+    except ValueError as error:
+        parser.error(str(error))
+    print(f"Packed {report['frames']} frames into {args.output} ({report['bytes'] / (1024 * 1024):.1f} MB)")
+    if report["stages"]:
+        from build_assets import summary_lines
+        for line in summary_lines(report):
+            print(line)
@@ -0,0 +1,326 @@
+from bisect import bisect_right
+from collections import OrderedDict, deque
+import queue
+import threading
+import time
+from PySide6.QtGui import QImage, QPixmap, QPainter
+from PySide6.QtCore import Qt, QRect
+from framepack import FLAG_DELTA, FLAG_KEYFRAME, read_patches
+
+
+# Format of the translucent window's backing store, frames in this format are
+# blitted without any conversion at paint time
+DISPLAY_FORMAT = QImage.Format_ARGB32_Premultiplied
+
+# Recent decode durations in ms kept by the decoding classes, for the
+# performance overlay
+DECODE_HISTORY = 240
+
+
+# Decode compressed PNG bytes, QImage is safe to build outside the GUI thread.
+# Frames are converted to the display format once here, frames of a pack with
+# a palette stay 8-bit indexed images, which delta patches are drawn from.
+def decode_frame(data, palette=None):
+    image = QImage.fromData(data, "PNG")
+    if palette is not None and image.reinterpretAsFormat(QImage.Format_Indexed8):
+        image.setColorTable(palette)
+        return image
+    if image.format() != DISPLAY_FORMAT:
+        image.convertTo(DISPLAY_FORMAT)
+    return image
+
+
+# Decode frame index of a frame source into a frame ready to paint, off the
+# GUI thread. Sources that already hold decoded pixels, like the on-disk raw
+# frame cache, decode themselves. Only the compressed frames stay indexed.
+def decode_source(source, index):
+    decode = getattr(source, "decode", None)
+    if decode is not None:
+        return expand_frame(decode(index))
+    return expand_frame(decode_frame(source[index], getattr(source, "palette", None)))
+
+
+# Indexed frames in the display format
+def expand_frame(image):
+    if image.format() == QImage.Format_Indexed8:
+        return image.convertToFormat(DISPLAY_FORMAT)
+    return image
+
+
+# Memory footprint of a decoded frame in bytes
+def frame_cost(frame):
+    if isinstance(frame, QImage):
+        return frame.sizeInBytes()
+    if isinstance(frame, QPixmap):
+        return frame.width() * frame.height() * max(frame.depth(), 8) // 8
+    return 0
+
+
+# LRU cache of decoded frames keyed by frame index, bounded by a memory budget
+class FrameCache:
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._frames = OrderedDict()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, index):
+        return index in self._frames
+
+    def indexes(self):
+        return list(self._frames)
+
+    def get(self, index):
+        frame = self._frames.get(index)
+        if frame is None:
+            self.misses += 1
+            return None
+        self._frames.move_to_end(index)
+        self.hits += 1
+        return frame[0]
+
+    def put(self, index, frame):
+        cost = frame_cost(frame)
+        if cost > self.budget_bytes:
+            # A frame larger than the whole budget is never worth keeping
+            return
+        self.discard(index)
+        self._frames[index] = (frame, cost)
+        self.used_bytes += cost
+        while self.used_bytes > self.budget_bytes:
+            _, (_, evicted_cost) = self._frames.popitem(last=False)
+            self.used_bytes -= evicted_cost
+            self.evictions += 1
+
+    def discard(self, index):
+        entry = self._frames.pop(index, None)
+        if entry is not None:
+            self.used_bytes -= entry[1]
+
+    def clear(self):
+        self._frames.clear()
+        self.used_bytes = 0
+
+    # Return the decoded frame for index, calling loader(index) on a miss
+    def fetch(self, index, loader):
+        frame = self.get(index)
+        if frame is None:
+            frame = loader(index)
+            if frame is not None and not frame.isNull():
+                self.put(index, frame)
+        return frame
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hit_rate(), 3),
+            "frames": len(self._frames),
+            "used_mb": round(self.used_bytes / (1024 * 1024), 1),
+            "budget_mb": round(self.budget_bytes / (1024 * 1024), 1),
+        }
+
+
+# Two tier frame store: every frame's compressed PNG bytes stay in memory and
+# only a sliding window of frames around the play position is kept decoded.
+# Without a cache nothing is kept, for sources that decode without any work.
+class FrameStore:
+    def __init__(self, sources, cache, behind=2, ahead=30):
+        self.sources = sources
+        self.cache = cache
+        self.behind = behind
+        self.ahead = ahead
+        self.position = 0
+        self.decode_times = deque(maxlen=DECODE_HISTORY)
+
+    def __len__(self):
+        return len(self.sources)
+
+    def compressed_bytes(self):
+        return sum(len(data) for data in self.sources)
+
+    def in_window(self, index):
+        distance = (index - self.position) % len(self.sources)
+        return distance <= self.ahead or len(self.sources) - distance <= self.behind
+
+    # Move the window to index and drop every decoded frame that fell out of it
+    def seek(self, index):
+        self.position = index
+        if self.cache is None:
+            return
+        for cached_index in self.cache.indexes():
+            if not self.in_window(cached_index):
+                self.cache.discard(cached_index)
+
+    def decode(self, index):
+        began = time.perf_counter()
+        frame = decode_source(self.sources, index)
+        self.decode_times.append((time.perf_counter() - began) * 1000)
+        return frame
+
+    def frame(self, index):
+        self.seek(index)
+        if self.cache is None:
+            return self.decode(index)
+        return self.cache.fetch(index, self.decode)
+
+    # Return the frame only if it is already decoded, never decodes itself
+    def peek(self, index):
+        return self.cache.get(index)
+
+    def insert(self, index, frame):
+        if self.in_window(index) and not frame.isNull():
+            self.cache.put(index, frame)
+
+
+# Pool of worker threads decoding the frames ahead of the play position. Decoded
+# frames are handed to the GUI thread through a bounded queue, workers wait
+# while the queue is full and drop their work when playback jumps elsewhere.
+class FrameDecoder:
+    def __init__(self, sources, ahead=8, workers=2, queue_size=8):
+        self.sources = sources
+        self.ahead = ahead
+        self.ready = queue.Queue(maxsize=queue_size)
+        self.decoded = 0
+        self.cancelled = 0
+        self.decode_times = deque(maxlen=DECODE_HISTORY)
+        self._wake = threading.Condition()
+        self._generation = 0
+        self._head = 0
+        self._scheduled = 0
+        self._running = True
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _work(self):
+        while True:
+            with self._wake:
+                while self._running and self._scheduled >= self.ahead:
+                    self._wake.wait()
+                if not self._running:
+                    return
+                generation = self._generation
+                index = (self._head + self._scheduled) % len(self.sources)
+                self._scheduled += 1
+
+            began = time.perf_counter()
+            image = decode_source(self.sources, index)
+            self.decode_times.append((time.perf_counter() - began) * 1000)
+            self.decoded += 1
+
+            # Push back while the GUI thread has not drained the queue yet
+            while True:
+                if generation != self._generation or not self._running:
+                    self.cancelled += 1
+                    break
+                try:
+                    self.ready.put((generation, index, image), timeout=0.05)
+                    break
+                except queue.Full:
+                    continue
+
+    # Tell the pool that the GUI thread now needs frames starting at index
+    def advance(self, index):
+        with self._wake:
+            consumed = (index - self._head) % len(self.sources)
+            if consumed <= self._scheduled:
+                self._scheduled -= consumed
+            else:
+                # Playback jumped, everything scheduled so far is stale
+                self._generation += 1
+                self._scheduled = 0
+                self._drain()
+            self._head = index
+            self._wake.notify_all()
+
+    def _drain(self):
+        while True:
+            try:
+                self.ready.get_nowait()
+            except queue.Empty:
+                return
+
+    # Collect the frames decoded since the last call without blocking
+    def take(self):
+        frames = []
+        while True:
+            try:
+                generation, index, image = self.ready.get_nowait()
+            except queue.Empty:
+                return frames
+            if generation == self._generation:
+                frames.append((index, image))
+
+    def stop(self):
+        with self._wake:
+            self._running = False
+            self._wake.notify_all()
+
+
+def has_delta_frames(source):
+    return any(source.flags(i) & FLAG_DELTA for i in range(len(source)))
+
+
+# Plays a pack of keyframes and delta frames into one persistent back buffer.
+# Moving forward applies the patches of every frame on the way unless the
+# keyframe before the target is closer, anything else seeks from that
+# keyframe. Patches are decoded on the calling thread.
+class DeltaPlayer:
+    def __init__(self, source, max_walk=60):
+        self.source = source
+        self.max_walk = max_walk
+        self.canvas = QImage(*source.canvas_size, DISPLAY_FORMAT)
+        self.canvas.fill(Qt.transparent)
+        self.keyframes = [i for i in range(len(source)) if source.flags(i) & FLAG_KEYFRAME]
+        self.index = None
+        self.patches_applied = 0
+        self.seeks = 0
+        self.decode_times = deque(maxlen=DECODE_HISTORY)
+
+    # Bring the back buffer to frame index, returns the rectangles that changed
+    def show(self, index):
+        if index == self.index:
+            return []
+        keyframe = self.keyframes[bisect_right(self.keyframes, index) - 1]
+        distance = None if self.index is None else (index - self.index) % len(self.source)
+        if distance is not None and distance <= min(self.max_walk, index - keyframe):
+            first = self.index + 1
+        else:
+            first = keyframe
+            self.seeks += 1
+
+        began = time.perf_counter()
+        dirty = []
+        painter = QPainter(self.canvas)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        for step in range((index - first) % len(self.source) + 1):
+            dirty.extend(self._apply(painter, (first + step) % len(self.source)))
+        painter.end()
+        self.index = index
+        self.decode_times.append((time.perf_counter() - began) * 1000)
+        return dirty
+
+    def _apply(self, painter, index):
+        x, y, w, h = self.source.bbox(index)
+        if not self.source.flags(index) & FLAG_DELTA:
+            painter.fillRect(self.canvas.rect(), Qt.transparent)
+            painter.drawImage(x, y, decode_frame(self.source[index], self.source.palette))
+            return [self.canvas.rect()]
+
+        rects = []
+        for (x, y, w, h), data in read_patches(self.source[index]):
+            painter.drawImage(x, y, decode_frame(data, self.source.palette))
+            rects.append(QRect(x, y, w, h))
+            self.patches_applied += 1
+        return rects
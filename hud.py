@@ -0,0 +1,83 @@
+from collections import deque
+from PySide6.QtWidgets import QWidget
+from PySide6.QtGui import QColor, QFont, QFontMetrics, QPainter
+from PySide6.QtCore import Qt, QTimer
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+# Overlay on the frame view listing what playback costs on this machine. The
+# player reports every frame it shows, sample() returns the rest of the
+# numbers and is polled a few times a second. A hit rate of None means the
+# frames are mapped from the disk cache without the decoded frame cache. While
+# hidden the overlay records nothing, runs no timer and paints nothing.
+class PerformanceHud(QWidget):
+    def __init__(self, parent, sample, history=240, refresh_ms=500):
+        super().__init__(parent)
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.sample = sample
+        self.intervals = deque(maxlen=history)
+        self.last_shown = None
+        self.lines = []
+        self.text_font = QFont("Consolas")
+        self.text_font.setStyleHint(QFont.Monospace)
+        self.text_font.setPointSize(8)
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(refresh_ms)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.hide()
+
+    def toggle(self):
+        self.setVisible(not self.isVisible())
+
+    def showEvent(self, event):
+        self.intervals.clear()
+        self.last_shown = None
+        self.refresh()
+        self.refresh_timer.start()
+
+    def hideEvent(self, event):
+        self.refresh_timer.stop()
+
+    # Called by the player with the monotonic time a frame reached the screen
+    def frame_shown(self, now):
+        if self.last_shown is not None:
+            self.intervals.append((now - self.last_shown) * 1000)
+        self.last_shown = now
+
+    def refresh(self):
+        stats = self.sample()
+        intervals = list(self.intervals)
+        fps = 1000 * len(intervals) / sum(intervals) if intervals and sum(intervals) else 0.0
+        decode_ms = stats.get("decode_ms") or []
+        rss = stats.get("rss_bytes")
+        hit_rate = stats.get("hit_rate", 0.0)
+        self.lines = [
+            f"FPS      {fps:.1f}",
+            f"Interval p50 {percentile(intervals, 0.5):.1f}  p95 {percentile(intervals, 0.95):.1f}  "
+            f"p99 {percentile(intervals, 0.99):.1f} ms",
+            f"Decode   {percentile(decode_ms, 0.5):.2f} ms  p95 {percentile(decode_ms, 0.95):.2f} ms",
+            f"Cache    {hit_rate:.0%} hits" if hit_rate is not None else "Cache    mapped",
+            f"Dropped  {stats.get('dropped', 0)}",
+            f"RSS      {rss / (1024 * 1024):.0f} MB" if rss is not None else "RSS      -",
+            f"Topmost  {stats.get('topmost_ms', 0.0):.1f} ms in {stats.get('topmost_checks', 0)} checks",
+        ]
+        metrics = QFontMetrics(self.text_font)
+        width = max(metrics.horizontalAdvance(line) for line in self.lines)
+        self.resize(width + 12, metrics.lineSpacing() * len(self.lines) + 8)
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(0, 0, 0, 170))
+        painter.setPen(Qt.white)
+        painter.setFont(self.text_font)
+        metrics = QFontMetrics(self.text_font)
+        for number, line in enumerate(self.lines):
+            painter.drawText(6, 4 + metrics.ascent() + number * metrics.lineSpacing(), line)
+        painter.end()
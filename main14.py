@@ -1,105 +1,77 @@
 from PySide6.QtWidgets import QApplication, QLabel, QWidget, QVBoxLayout, QDialog, QPushButton, QSystemTrayIcon, QSlider
-from PySide6.QtGui import QPixmap, QMouseEvent, QKeyEvent, QIcon, QKeySequence, QCursor
-from PySide6.QtCore import QTimer, Qt, QPoint, QThread, Signal
+from PySide6.QtGui import QMouseEvent, QKeyEvent, QIcon, QKeySequence, QCursor
+from PySide6.QtCore import Qt, QPoint, QThread, Signal
 import os
 import sys
-import json
-import threading
-import time
-import win32gui
-import win32con
+from frames import FrameCache, has_delta_frames, decode_source
+from framepack import FramePack, LooseFrames
+from playback import Player
+from topmost import TopmostManager, default_backend
+from settings import SettingsModel, DEFAULT_SETTINGS
+from frame_view import FrameView
+from disk_cache import FrameDiskCache, source_key
+from hud import PerformanceHud
+from memory import rss_bytes
 
 # Determine the base path for the executable
 base_path = getattr(sys, '_MEIPASS', os.path.abspath("."))
 
-# Path to save the settings in JSON format
-SETTINGS_FILE = os.path.join(os.path.expanduser("~"), "bailando_settings.json")
-DEFAULT_SETTINGS = {
-    "position": {
-        "x": 500,
-        "y": 500
-    },
-    "hotkey": "End",
-    "opacity": 255
-}
-
-
-def keep_window_on_top():
-    def monitor_window():
-        while True:
-            hwnd = win32gui.FindWindow(None, window.windowTitle())
-            if hwnd:
-                # Ensure the window is always on top
-                win32gui.SetWindowPos(hwnd, win32con.HWND_TOPMOST, 0, 0, 0, 0, win32con.SWP_NOMOVE | win32con.SWP_NOSIZE)
-            time.sleep(0.01)  # Check every 10ms to ensure it stays on top
-
-    # Run the monitoring function in a separate thread to avoid blocking the main UI thread
-    thread = threading.Thread(target=monitor_window, daemon=True)
-    thread.start()
-
-# Function to load settings from the JSON file
-def load_data():
-    if os.path.exists(SETTINGS_FILE):
-        try:
-            with open(SETTINGS_FILE, "r") as file:
-                data = json.load(file)
-                x = data.get('position', {}).get('x', DEFAULT_SETTINGS['position']['x'])
-                y = data.get('position', {}).get('y', DEFAULT_SETTINGS['position']['y'])
-                hotkey = data.get('hotkey', DEFAULT_SETTINGS['hotkey'])
-                transparency = data.get('opacity', DEFAULT_SETTINGS['opacity'])
-                print("Loaded settings from JSON:")
-                print(f"Position: ({x}, {y}), Hotkey: {hotkey}, Opacity: {transparency}")
-                return QPoint(x, y), hotkey, transparency
-        except json.JSONDecodeError:
-            # Remove corrupted file and reset to default settings
-            print("Error loading JSON. Resetting to default settings.")
-            os.remove(SETTINGS_FILE)
-            save_data(
-                position=QPoint(DEFAULT_SETTINGS['position']['x'], DEFAULT_SETTINGS['position']['y']),
-                hotkey=DEFAULT_SETTINGS['hotkey'],
-                transparency=DEFAULT_SETTINGS['opacity']
-            )
-            return QPoint(DEFAULT_SETTINGS['position']['x'], DEFAULT_SETTINGS['position']['y']), \
-                   DEFAULT_SETTINGS['hotkey'], DEFAULT_SETTINGS['opacity']
-    else:
-        print("No settings file found, loading default settings.")
-        return QPoint(DEFAULT_SETTINGS['position']['x'], DEFAULT_SETTINGS['position']['y']), \
-               DEFAULT_SETTINGS['hotkey'], DEFAULT_SETTINGS['opacity']
-
-
-
-# Function to save settings to the JSON file
-def save_data(position=None, hotkey=None, transparency=None):
-    settings = {}
-    if position:
-        settings['position'] = {'x': position.x(), 'y': position.y()}
-    if hotkey:
-        settings['hotkey'] = hotkey
-    if transparency is not None:
-        settings['opacity'] = transparency
-
-    # Load existing settings if any
-    if os.path.exists(SETTINGS_FILE):
-        with open(SETTINGS_FILE, "r") as file:
-            existing_data = json.load(file)
-            settings = {**existing_data, **settings}
-
-    # Save the updated settings back to the file
-    with open(SETTINGS_FILE, "w") as file:
-        json.dump(settings, file, indent=4)
-
-    # Debug print statement
-    print("Saved settings to JSON:")
-    print(json.dumps(settings, indent=4))
-
-# Thread for loading images
+# Remove the decoded frames cached on disk and quit
+if "--clear-cache" in sys.argv:
+    print(f"Removed {FrameDiskCache().clear()} cached frame files")
+    sys.exit(0)
+
+# Memory budget for decoded frames, each decoded frame takes about 0.55 MB
+FRAME_CACHE_MB = int(os.environ.get("BAILANDO_FRAME_CACHE_MB", "64"))
+# Decoded frames kept around the current frame, the rest stay compressed
+FRAME_WINDOW_BEHIND = 2
+FRAME_WINDOW_AHEAD = 30
+# Background decoding of the frames ahead of the current one
+FRAME_DECODE_WORKERS = 2
+FRAME_DECODE_AHEAD = 12
+# How soon to look again when the due frame is not decoded yet
+FRAME_RETRY_MS = 5
+# Skip stale frames when the GUI thread falls behind instead of slowing down
+FRAME_DROPPING = True
+# Key showing and hiding the performance overlay
+HUD_KEY = Qt.Key_F3
+
+
+# Thread for loading images, maps the packed frame archive when the build has
+# one and otherwise reads the compressed bytes of every loose frame once, in
+# the order and with the timing of the img manifest if there is one. Playback
+# starts on those right away. Then the frames are looked up in the on-disk
+# cache of decoded frames, a hit is handed over to play from instead and a
+# miss decodes them once more in the background for the next launch. Sets too
+# large for the cache limit are never cached.
 class ImageLoaderThread(QThread):
-    images_loaded = Signal(list)
+    images_loaded = Signal(object)
+    cached_frames_loaded = Signal(object)
 
     def run(self):
-        image_folder = os.path.join(base_path, "img")
-        image_files = sorted(f for f in os.listdir(image_folder) if f.lower().endswith('.png'))
-        self.images_loaded.emit(image_files)
+        pack_path = os.path.join(base_path, "frames.pack")
+        if os.path.exists(pack_path):
+            frames = FramePack(pack_path)
+        else:
+            frames = LooseFrames(os.path.join(base_path, "img"))
+        self.images_loaded.emit(frames)
+        if has_delta_frames(frames):
+            return
+
+        disk_cache = FrameDiskCache()
+        if not disk_cache.fits(frames):
+            # Too large to keep mapped, keep playing the compressed frames
+            return
+        key = source_key(frames)
+        raw_frames = disk_cache.open(key, frames)
+        if raw_frames:
+            self.cached_frames_loaded.emit(raw_frames)
+            return
+        try:
+            disk_cache.store(key, frames, lambda index: decode_source(frames, index),
+                             self.isInterruptionRequested)
+        except OSError as error:
+            print(f"Could not cache decoded frames: {error}")
 
 # Set up the main application window
 app = QApplication(sys.argv)
@@ -108,68 +80,71 @@ window.setWindowTitle("Bailando")
 window.setFixedSize(450, 300)
 window.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint)
 window.setAttribute(Qt.WA_TranslucentBackground)
-keep_window_on_top()
+
+# Keep the window above others, driven by z-order change notifications
+topmost = TopmostManager(default_backend())
 
 if hasattr(sys, '_MEIPASS'):
     exe_icon_path = os.path.join(base_path, "icon.ico")
     window.setWindowIcon(QIcon(exe_icon_path))
 
 # Load data and set initial position of the window
-position, hotkey, transparency = load_data()
-window.move(position)
-window.setWindowOpacity(transparency / 255)  # Set the initial opacity
+settings = SettingsModel()
+window.move(settings.position())
+window.setWindowOpacity(settings.opacity() / 255)  # Set the initial opacity
 
-def update_hotkey():
+def update_hotkey(hotkey_text):
     global hotkey
-    position, hotkey_text, transparency = load_data()
     try:
         hotkey = getattr(Qt, f"Key_{hotkey_text.capitalize()}")
     except AttributeError:
         hotkey = Qt.Key_End
 
-# Timer to check for changes in settings.json
-settings_check_timer = QTimer()
-settings_check_timer.setInterval(1000)  # Check every second
-settings_check_timer.timeout.connect(update_hotkey)
-settings_check_timer.start()
+def update_opacity(opacity):
+    window.setWindowOpacity(opacity / 255)
+
+# The settings file is only read again when it actually changes on disk
+update_hotkey(settings.hotkey())
+settings.hotkey_changed.connect(update_hotkey)
+settings.opacity_changed.connect(update_opacity)
 
-# Layout and label for displaying images
+# Layout and view for displaying images
 layout = QVBoxLayout()
-label = QLabel()
-label.setAlignment(Qt.AlignTop | Qt.AlignLeft)
-label.setAttribute(Qt.WA_TranslucentBackground)
-label.setStyleSheet("background: transparent;")
-layout.addWidget(label)
+frame_view = FrameView()
+layout.addWidget(frame_view)
 window.setLayout(layout)
 
-# Initialize image index and images list
-image_index = 0
-image_files = []
-current_image = None
-
-# Update image function
-def update_image():
-    global image_index, current_image
-    if image_files:
-        next_image_path = os.path.join(base_path, "img", image_files[image_index])
-        current_image = QPixmap(next_image_path)
-        label.setPixmap(current_image)
-        image_index = (image_index + 1) % len(image_files)
-
-# Set up a timer to update the image
-image_update_timer = QTimer()
-image_update_timer.timeout.connect(update_image)
-image_update_timer.start(30)
+# Numbers for the performance overlay, only gathered while it is shown
+def hud_sample():
+    decoding = player.decoding()
+    topmost_stats = topmost.stats()
+    return {
+        "decode_ms": list(decoding.decode_times) if decoding else [],
+        "hit_rate": None if player.mapped() else frame_cache.hit_rate(),
+        "dropped": player.scheduler.dropped if player.scheduler else 0,
+        "rss_bytes": rss_bytes(),
+        "topmost_ms": topmost_stats["cost_ms"],
+        "topmost_checks": topmost_stats["checks"],
+    }
+
+hud = PerformanceHud(frame_view, hud_sample)
+
+# Reports the frames reaching the screen to the overlay while it is shown
+def on_frame_shown(now):
+    if hud.isVisible():
+        hud.frame_shown(now)
+
+# Plays the frames on the view, shows the frame due on the monotonic clock and
+# re-arms its timer for the next deadline
+frame_cache = FrameCache(FRAME_CACHE_MB * 1024 * 1024)
+player = Player(frame_view, frame_cache, FRAME_WINDOW_BEHIND, FRAME_WINDOW_AHEAD, FRAME_DECODE_AHEAD,
+                FRAME_DECODE_WORKERS, FRAME_RETRY_MS, FRAME_DROPPING, on_frame_shown)
 
 # Load images using threading
-def on_images_loaded(images_list):
-    global image_files
-    image_files = images_list
-    update_image()
-
 image_loader_thread = ImageLoaderThread()
-image_loader_thread.images_loaded.connect(on_images_loaded)
-image_loader_thread.start()
+image_loader_thread.images_loaded.connect(player.load)
+image_loader_thread.cached_frames_loaded.connect(player.use_cached)
+image_loader_thread.start(QThread.LowPriority)
 
 # Create a system tray icon
 tray_icon = QSystemTrayIcon(QIcon(os.path.join(base_path, "icon.ico")), parent=app)
@@ -196,7 +171,7 @@ def mouseReleaseEvent(event: QMouseEvent):
     global dragging
     if event.button() == Qt.LeftButton:
         dragging = False
-        save_data(position=window.pos(), transparency=int(window.windowOpacity() * 255))
+        settings.update(position=window.pos(), transparency=int(window.windowOpacity() * 255))
 
 class ConfigDialog(QDialog):
     def __init__(self):
@@ -211,7 +186,7 @@ class ConfigDialog(QDialog):
         # Slider for transparency
         self.transparency_slider = QSlider(Qt.Horizontal)
         self.transparency_slider.setRange(0, 255)
-        self.transparency_slider.setValue(transparency)  # Set the initial value from JSON
+        self.transparency_slider.setValue(settings.opacity())  # Set the initial value from JSON
         self.transparency_slider.valueChanged.connect(self.change_transparency)
         self.layout.addWidget(QLabel("Adjust Transparency:"))
         self.layout.addWidget(self.transparency_slider)
@@ -230,8 +205,8 @@ class ConfigDialog(QDialog):
 
     def keyPressEvent(self, event: QKeyEvent):
         # Check for the valid keys
-        if event.key() in [Qt.Key_Escape, Qt.Key_Home]:
-            # Ignore Escape and Home keys for hotkey assignment
+        if event.key() in [Qt.Key_Escape, Qt.Key_Home, HUD_KEY]:
+            # Ignore Escape, Home and the overlay key for hotkey assignment
             return
         
         self.current_key = event.key()
@@ -250,11 +225,11 @@ class ConfigDialog(QDialog):
                 self.hotkey_label.setText("Home key cannot be set as hotkey!")
                 return  # Prevent saving the Home key
             hotkey_text = QKeySequence(self.current_key).toString().upper()
-            save_data(hotkey=hotkey_text)
+            settings.update(hotkey=hotkey_text)
 
         # Save the current transparency value
         transparency_value = self.transparency_slider.value()
-        save_data(transparency=transparency_value)
+        settings.update(transparency=transparency_value)
         window.setWindowOpacity(transparency_value / 255)  # Update window opacity
         
         self.accept()
@@ -271,7 +246,7 @@ class ConfigDialog(QDialog):
         window.setWindowOpacity(DEFAULT_SETTINGS['opacity'] / 255)
 
         # Save default settings to the settings file
-        save_data(
+        settings.update(
             position=QPoint(DEFAULT_SETTINGS['position']['x'], DEFAULT_SETTINGS['position']['y']),
             hotkey=DEFAULT_SETTINGS['hotkey'],
             transparency=DEFAULT_SETTINGS['opacity']
@@ -284,12 +259,16 @@ def keyPressEvent(event: QKeyEvent):
         locked = not locked
         window.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | (Qt.Tool if locked else 0))
         window.show()
+        topmost.attach(int(window.winId()))  # Changing the flags recreates the native window
         tray_icon.setVisible(locked)
 
     elif event.key() == Qt.Key_Home:
         config_dialog = ConfigDialog()
         config_dialog.exec()
 
+    elif event.key() == HUD_KEY:
+        hud.toggle()
+
 # Connect mouse events and key event to the window
 window.mousePressEvent = mousePressEvent
 window.mouseMoveEvent = mouseMoveEvent
@@ -299,11 +278,23 @@ window.keyPressEvent = keyPressEvent
 # Override the closeEvent of the window
 def closeEvent(event):
     # Save data when the window is closed
-    save_data(position=window.pos(), transparency=int(window.windowOpacity() * 255))
+    settings.update(position=window.pos(), transparency=int(window.windowOpacity() * 255))
+    settings.close()  # Wait for the pending write to reach the disk
 
     # Print position and transparency for debugging
     print(f"Closing window, saving position: {window.pos()}, transparency: {int(window.windowOpacity() * 255)}")
     print("Settings saved on close event.")
+    print(f"Frame cache: {frame_cache.stats()}")
+    print(f"Topmost: {topmost.stats()}")
+    topmost.detach()
+    # Stop caching decoded frames if the first launch is still at it
+    image_loader_thread.requestInterruption()
+    image_loader_thread.wait()
+    if player.scheduler:
+        print(f"Playback: {player.scheduler.stats()}")
+    player.stop()
+    if player.store:
+        print(f"Frame store: {len(player.store)} frames, {player.store.compressed_bytes() / (1024 * 1024):.1f} MB compressed")
 
     event.accept()
     app.quit()
@@ -312,4 +303,5 @@ window.closeEvent = closeEvent  # Set the custom close event
 
 # Show the window
 window.show()
+topmost.attach(int(window.winId()))
 sys.exit(app.exec())
@@ -0,0 +1,180 @@
+from bisect import bisect_right
+from itertools import accumulate
+import math
+import time
+from PySide6.QtCore import Qt, QPoint, QTimer
+from frames import DeltaPlayer, FrameDecoder, FrameStore, has_delta_frames
+
+
+# Picks the frame to show from a monotonic clock and the per-frame delays, so
+# timer jitter never adds up and the loop keeps its real length over time
+class FrameScheduler:
+    def __init__(self, delays_ms, clock=time.monotonic, drop_frames=True):
+        self.drop_frames = drop_frames
+        self.shown = 0
+        self.dropped = 0
+        self.last_index = None
+        self.delays = [delay / 1000 for delay in delays_ms]
+        self.starts = [0.0] + list(accumulate(self.delays))[:-1]
+        self.duration = sum(self.delays)
+        self.clock = clock
+        self.start_time = None
+
+    def __len__(self):
+        return len(self.delays)
+
+    @property
+    def started(self):
+        return self.start_time is not None
+
+    # Anchor the clock so that index is the frame due right now
+    def start(self, index=0, now=None):
+        now = self.clock() if now is None else now
+        self.start_time = now - self.starts[index]
+
+    def _elapsed(self, now):
+        return (now - self.start_time) % self.duration
+
+    def frame_at(self, now=None):
+        now = self.clock() if now is None else now
+        return bisect_right(self.starts, self._elapsed(now)) - 1
+
+    # Seconds until the frame after the current one is due
+    def time_to_next(self, now=None):
+        now = self.clock() if now is None else now
+        elapsed = self._elapsed(now)
+        index = bisect_right(self.starts, elapsed) - 1
+        return self.starts[index] + self.delays[index] - elapsed
+
+    # Frame to show next. When playback fell several deadlines behind it is
+    # the due frame, skipping the stale ones, or with drop_frames off it is the
+    # frame after the last shown one and the clock is re-anchored so the
+    # animation slows down instead
+    def next_frame(self, now=None):
+        now = self.clock() if now is None else now
+        due = self.frame_at(now)
+        if self.drop_frames or self.last_index is None:
+            return due
+        if (due - self.last_index) % len(self.delays) > 1:
+            due = (self.last_index + 1) % len(self.delays)
+            self.start(due, now)
+        return due
+
+    # Record a frame reaching the screen and count the frames skipped before it
+    def frame_shown(self, index):
+        if self.last_index is not None:
+            self.dropped += max(0, (index - self.last_index) % len(self.delays) - 1)
+        self.last_index = index
+        self.shown += 1
+
+    def stats(self):
+        return {"shown": self.shown, "dropped": self.dropped}
+
+
+# Shows the frames of a frame source on a frame view, each at the deadline the
+# scheduler picks. Frames are decoded ahead by the decoder pool into a sliding
+# window, mapped raw frames are wrapped on demand and delta packs are played
+# into a back buffer. frame_shown(now) is called for every frame put on screen.
+class Player:
+    def __init__(self, view, cache, behind=2, ahead=30, decode_ahead=12, decode_workers=2, retry_ms=5,
+                 drop_frames=True, frame_shown=None):
+        self.view = view
+        self.cache = cache
+        self.behind = behind
+        self.ahead = ahead
+        self.decode_ahead = decode_ahead
+        self.decode_workers = decode_workers
+        self.retry_ms = retry_ms
+        self.drop_frames = drop_frames
+        self.frame_shown = frame_shown
+        self.source = None
+        self.store = None
+        self.decoder = None
+        self.delta_player = None
+        self.scheduler = None
+        self.index = 0
+        self.image = None
+        # Single shot precise timer, re-armed for every frame deadline
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+
+    # Start playing frames from the first one
+    def load(self, frames):
+        self.source = frames
+        if has_delta_frames(frames):
+            self.delta_player = DeltaPlayer(frames)
+        else:
+            self.store = FrameStore(frames, self.cache, self.behind, self.ahead)
+            self.decoder = FrameDecoder(frames, self.decode_ahead, self.decode_workers)
+        self.scheduler = FrameScheduler([frames.delay(i) for i in range(len(frames))], drop_frames=self.drop_frames)
+        self.tick()
+
+    # Switch to the decoded frames of the disk cache, same frames and timing.
+    # They live in the page cache and only wrap the map, so they bypass the
+    # decoded frame cache and leave residency and eviction to the OS.
+    def use_cached(self, frames):
+        if self.decoder:
+            self.decoder.stop()
+            self.decoder = None
+        self.cache.clear()
+        self.source = frames
+        self.store = FrameStore(frames, None)
+
+    def mapped(self):
+        return getattr(self.source, "mapped", False)
+
+    # Whatever decodes the frames right now, it keeps the recent decode times
+    def decoding(self):
+        return self.decoder or self.delta_player or self.store
+
+    # Show the due frame if the decoder pool already prepared it and re-arm the
+    # timer for the next deadline
+    def tick(self):
+        if not self.scheduler:
+            return
+        now = time.monotonic()
+        if self.scheduler.started:
+            self.index = self.scheduler.next_frame(now)
+        if self.index == self.scheduler.last_index:
+            # Woke up a little early, the due frame is already on screen
+            self.timer.start(max(1, math.ceil(self.scheduler.time_to_next(now) * 1000)))
+            return
+
+        if self.delta_player:
+            # Delta packs decode their patches right here on the GUI thread, the
+            # decoder pool cannot prepare frames of a shared back buffer ahead
+            self.image = self.delta_player.canvas
+            self.view.set_canvas(self.image, self.delta_player.show(self.index))
+        else:
+            self.store.seek(self.index)
+            if self.decoder:
+                self.decoder.advance(self.index)
+                for index, image in self.decoder.take():
+                    self.store.insert(index, image)
+                image = self.store.peek(self.index)
+                if image is None:
+                    # Keep showing the current frame until the due one is decoded
+                    self.timer.start(self.retry_ms)
+                    return
+            else:
+                # Mapped raw frames only wrap the memory map, nothing to decode ahead
+                image = self.store.frame(self.index)
+            self.image = image
+            x, y = self.source.bbox(self.index)[:2]
+            self.view.set_frame(image, QPoint(x, y))
+            if self.decoder:
+                self.decoder.advance((self.index + 1) % len(self.store))
+
+        if not self.scheduler.started:
+            self.scheduler.start(self.index, now)
+        self.scheduler.frame_shown(self.index)
+        if self.frame_shown:
+            self.frame_shown(now)
+        self.timer.start(max(1, math.ceil(self.scheduler.time_to_next(now) * 1000)))
+
+    def stop(self):
+        self.timer.stop()
+        if self.decoder:
+            self.decoder.stop()
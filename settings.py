@@ -0,0 +1,190 @@
+from PySide6.QtCore import QObject, QFileSystemWatcher, QPoint, QTimer, Signal
+import copy
+import os
+import json
+import queue
+import threading
+
+# Path to save the settings in JSON format
+SETTINGS_FILE = os.path.join(os.path.expanduser("~"), "bailando_settings.json")
+DEFAULT_SETTINGS = {
+    "position": {
+        "x": 500,
+        "y": 500
+    },
+    "hotkey": "End",
+    "opacity": 255
+}
+
+
+# Function to read the settings file merged over the defaults, returns None
+# when the file exists but is not valid JSON
+def read_settings(path=SETTINGS_FILE):
+    settings = json.loads(json.dumps(DEFAULT_SETTINGS))
+    if not os.path.exists(path):
+        return settings
+    try:
+        with open(path, "r") as file:
+            data = json.load(file)
+    except json.JSONDecodeError:
+        return None
+    settings['position'].update(data.get('position', {}))
+    settings.update({key: value for key, value in data.items() if key != 'position'})
+    return settings
+
+
+# Function to write the settings through a temp file and a rename, so a crash
+# half way leaves the previous file in place instead of a truncated one
+def write_settings(data, path=SETTINGS_FILE):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as file:
+        json.dump(data, file, indent=4)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+# Batches settings writes over a short window on the GUI thread and performs
+# them on a background thread, only the latest snapshot is ever written
+class SettingsWriter(QObject):
+    def __init__(self, path=SETTINGS_FILE, delay_ms=300, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.writes = 0
+        self._snapshot = None
+        self._queue = queue.Queue()
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay_ms)
+        self.timer.timeout.connect(self.flush)
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self):
+        return self._snapshot is not None or self._queue.unfinished_tasks > 0
+
+    def schedule(self, data):
+        self._snapshot = copy.deepcopy(data)
+        self.timer.start()  # Restarting the timer pushes the write back
+
+    def flush(self):
+        self.timer.stop()
+        if self._snapshot is not None:
+            self._queue.put(self._snapshot)
+            self._snapshot = None
+
+    def _work(self):
+        while True:
+            data = self._queue.get()
+            try:
+                if data is None:
+                    return
+                write_settings(data, self.path)
+                self.writes += 1
+            except OSError as error:
+                print(f"Could not save settings: {error}")
+            finally:
+                self._queue.task_done()
+
+    # Write anything still pending and wait for the worker to finish
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._queue.join()
+
+
+# In memory copy of the settings file. It is read once and only read again when
+# the file watcher reports a change that also moved the file's mtime or size,
+# changed values are announced through signals.
+class SettingsModel(QObject):
+    changed = Signal(dict)
+    hotkey_changed = Signal(str)
+    opacity_changed = Signal(int)
+
+    def __init__(self, path=SETTINGS_FILE, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.data = read_settings(path)
+        if self.data is None:
+            # Corrupted file, start over from the defaults
+            print("Error loading JSON. Resetting to default settings.")
+            os.remove(path)
+            self.data = read_settings(path)
+        self._stamp = self._file_stamp()
+        self.writer = SettingsWriter(path, parent=self)
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self._on_file_changed)
+        self.watcher.directoryChanged.connect(self._on_file_changed)
+        self._watch()
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    # Watch the file itself, or its folder until the file exists. Replacing the
+    # file drops it from the watcher so this is done again after every change.
+    def _watch(self):
+        watched = self.watcher.files() + self.watcher.directories()
+        if watched:
+            self.watcher.removePaths(watched)
+        if os.path.exists(self.path):
+            self.watcher.addPath(self.path)
+        else:
+            self.watcher.addPath(os.path.dirname(self.path))
+
+    def _on_file_changed(self, _path):
+        self._watch()
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return
+        self._stamp = stamp
+        self.reload()
+
+    def reload(self):
+        if self.writer.pending:
+            return  # Our own newer values are about to be written
+        data = read_settings(self.path)
+        if data is None:
+            return  # Half written by someone else, keep what we have
+        self._apply(data)
+
+    # Change values in memory and schedule a write of the whole file
+    def update(self, position=None, hotkey=None, transparency=None):
+        data = copy.deepcopy(self.data)
+        if position:
+            data['position'] = {'x': position.x(), 'y': position.y()}
+        if hotkey:
+            data['hotkey'] = hotkey
+        if transparency is not None:
+            data['opacity'] = transparency
+        if self._apply(data) or not os.path.exists(self.path):
+            self.writer.schedule(self.data)
+
+    def _apply(self, data):
+        changed = {key: value for key, value in data.items() if self.data.get(key) != value}
+        self.data = data
+        if not changed:
+            return False
+        self.changed.emit(changed)
+        if 'hotkey' in changed:
+            self.hotkey_changed.emit(data['hotkey'])
+        if 'opacity' in changed:
+            self.opacity_changed.emit(data['opacity'])
+        return True
+
+    def close(self):
+        self.writer.close()
+
+    def position(self):
+        return QPoint(self.data['position']['x'], self.data['position']['y'])
+
+    def hotkey(self):
+        return self.data['hotkey']
+
+    def opacity(self):
+        return self.data['opacity']
@@ -1,10 +1,7 @@
 import sys
-import time
-import threading
-import win32gui
-import win32con
 from PySide6.QtWidgets import QApplication, QMainWindow
 from PySide6.QtCore import Qt
+from topmost import TopmostManager, default_backend
 
 class MyWindow(QMainWindow):
     def __init__(self):
@@ -18,21 +15,12 @@ class MyWindow(QMainWindow):
         # Make the window transparent (optional, if you want a blank window)
         self.setAttribute(Qt.WA_TranslucentBackground, True)
 
-        # Start a background thread to keep the window on top
-        self.keep_window_on_top()
+        # Re-assert topmost whenever the z-order changes and the window lost it
+        self.topmost = TopmostManager(default_backend())
 
-    def keep_window_on_top(self):
-        def monitor_window():
-            while True:
-                hwnd = win32gui.FindWindow(None, self.windowTitle())
-                if hwnd:
-                    # Ensure the window is always on top
-                    win32gui.SetWindowPos(hwnd, win32con.HWND_TOPMOST, 0, 0, 0, 0, win32con.SWP_NOMOVE | win32con.SWP_NOSIZE)
-                time.sleep(0.01)  # Check every 100ms
-
-        # Run the monitoring function in a separate thread to avoid blocking the main UI thread
-        thread = threading.Thread(target=monitor_window, daemon=True)
-        thread.start()
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.topmost.attach(int(self.winId()))
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
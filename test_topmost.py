@@ -0,0 +1,45 @@
+import unittest
+from topmost import FakeTopmostBackend, TopmostManager
+
+# TopmostManager against the in memory backend, run with: python -m unittest test_topmost
+HANDLE = 42
+
+
+class TopmostManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = FakeTopmostBackend()
+        self.manager = TopmostManager(self.backend)
+
+    def test_attach_reasserts_once(self):
+        self.manager.attach(HANDLE)
+        self.assertEqual(self.backend.set_calls, 1)
+        self.assertEqual(self.manager.reasserts, 1)
+        self.assertIsNotNone(self.backend.callback)
+
+    def test_ensure_leaves_a_topmost_window_alone(self):
+        self.manager.attach(HANDLE)
+        self.manager.ensure()
+        self.manager.ensure()
+        self.assertEqual(self.backend.set_calls, 1)
+        self.assertEqual(self.manager.checks, 3)
+
+    def test_cover_reasserts_once(self):
+        self.manager.attach(HANDLE)
+        self.backend.cover(HANDLE)
+        self.assertEqual(self.backend.set_calls, 2)
+        self.assertEqual(self.manager.reasserts, 2)
+        self.assertTrue(self.backend.is_topmost(HANDLE))
+
+    def test_detach_stops_checking(self):
+        self.manager.attach(HANDLE)
+        self.manager.detach()
+        self.assertIsNone(self.backend.callback)
+        checks = self.manager.checks
+        self.backend.cover(HANDLE)
+        self.manager.ensure()
+        self.assertEqual(self.manager.checks, checks)
+        self.assertEqual(self.backend.set_calls, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
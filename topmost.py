@@ -0,0 +1,155 @@
+from abc import ABC, abstractmethod
+import sys
+import time
+
+
+# Platform side of keeping a window on top. A backend reports whether the
+# window still sits above everything, puts it back there and calls back when
+# the z-order of the desktop may have changed.
+class TopmostBackend(ABC):
+    @abstractmethod
+    def is_topmost(self, handle):
+        pass
+
+    @abstractmethod
+    def set_topmost(self, handle):
+        pass
+
+    @abstractmethod
+    def watch(self, callback):
+        pass
+
+    def unwatch(self):
+        pass
+
+
+# Windows backend, z-order changes arrive through an out of context WinEvent
+# hook which is delivered on the thread running the Qt event loop
+class Win32TopmostBackend(TopmostBackend):
+    EVENT_SYSTEM_FOREGROUND = 0x0003
+    EVENT_OBJECT_REORDER = 0x8004
+    WINEVENT_OUTOFCONTEXT = 0x0000
+    WINEVENT_SKIPOWNPROCESS = 0x0002
+
+    def __init__(self):
+        import ctypes
+        import ctypes.wintypes
+        import win32con
+        import win32gui
+        self.ctypes = ctypes
+        self.win32con = win32con
+        self.win32gui = win32gui
+        self.user32 = ctypes.windll.user32
+        self.hook_type = ctypes.WINFUNCTYPE(
+            None, ctypes.wintypes.HANDLE, ctypes.wintypes.DWORD, ctypes.wintypes.HWND,
+            ctypes.wintypes.LONG, ctypes.wintypes.LONG, ctypes.wintypes.DWORD, ctypes.wintypes.DWORD)
+        self.user32.SetWinEventHook.restype = ctypes.wintypes.HANDLE
+        self._hooks = []
+        self._hook_proc = None
+
+    def is_topmost(self, handle):
+        if not self.win32gui.GetWindowLong(handle, self.win32con.GWL_EXSTYLE) & self.win32con.WS_EX_TOPMOST:
+            return False
+        # Only other topmost windows can sit above a topmost one
+        above = self.win32gui.GetWindow(handle, self.win32con.GW_HWNDPREV)
+        while above:
+            if self.win32gui.IsWindowVisible(above):
+                return False
+            above = self.win32gui.GetWindow(above, self.win32con.GW_HWNDPREV)
+        return True
+
+    def set_topmost(self, handle):
+        self.win32gui.SetWindowPos(handle, self.win32con.HWND_TOPMOST, 0, 0, 0, 0,
+                                   self.win32con.SWP_NOMOVE | self.win32con.SWP_NOSIZE | self.win32con.SWP_NOACTIVATE)
+
+    def watch(self, callback):
+        self.unwatch()
+
+        def on_event(hook, event, hwnd, id_object, id_child, thread, timestamp):
+            if id_object == 0 and id_child == 0:  # OBJID_WINDOW, CHILDID_SELF
+                callback()
+
+        # Keep a reference, ctypes does not keep the callback alive
+        self._hook_proc = self.hook_type(on_event)
+        for event in (self.EVENT_SYSTEM_FOREGROUND, self.EVENT_OBJECT_REORDER):
+            self._hooks.append(self.user32.SetWinEventHook(
+                event, event, 0, self._hook_proc, 0, 0,
+                self.WINEVENT_OUTOFCONTEXT | self.WINEVENT_SKIPOWNPROCESS))
+
+    def unwatch(self):
+        for hook in self._hooks:
+            self.user32.UnhookWinEvent(hook)
+        self._hooks = []
+        self._hook_proc = None
+
+
+# In memory backend for exercising TopmostManager without a window system
+class FakeTopmostBackend(TopmostBackend):
+    def __init__(self):
+        self.topmost = set()
+        self.set_calls = 0
+        self.callback = None
+
+    def is_topmost(self, handle):
+        return handle in self.topmost
+
+    def set_topmost(self, handle):
+        self.set_calls += 1
+        self.topmost.add(handle)
+
+    def watch(self, callback):
+        self.callback = callback
+
+    def unwatch(self):
+        self.callback = None
+
+    # Simulate another window taking the top of the z-order
+    def cover(self, handle):
+        self.topmost.discard(handle)
+        if self.callback:
+            self.callback()
+
+
+def default_backend():
+    if sys.platform == "win32":
+        return Win32TopmostBackend()
+    # Elsewhere Qt.WindowStaysOnTopHint is all we have
+    return None
+
+
+# Keeps one native window on top, re-asserting it only after a z-order change
+# notification shows that the window actually lost its place
+class TopmostManager:
+    def __init__(self, backend):
+        self.backend = backend
+        self.handle = None
+        self.checks = 0
+        self.reasserts = 0
+        self.cost = 0.0
+
+    # Cache the native handle, call again whenever Qt recreates the window
+    def attach(self, handle):
+        if self.backend is None:
+            return
+        if self.handle is None:
+            self.backend.watch(self.ensure)
+        self.handle = handle
+        self.ensure()
+
+    def detach(self):
+        if self.backend is not None and self.handle is not None:
+            self.backend.unwatch()
+        self.handle = None
+
+    def ensure(self):
+        if self.handle is None:
+            return
+        start = time.perf_counter()
+        self.checks += 1
+        if not self.backend.is_topmost(self.handle):
+            self.backend.set_topmost(self.handle)
+            self.reasserts += 1
+        self.cost += time.perf_counter() - start
+
+    def stats(self):
+        return {"checks": self.checks, "reasserts": self.reasserts, "cost_ms": round(self.cost * 1000, 2)}